@@ -15,6 +15,7 @@ from contextlib import asynccontextmanager
 load_dotenv()
 
 from db_config import DB_CONFIG
+from conferences.controller.importer import shutdown_text_pool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -92,6 +93,7 @@ async def test_dependency_startup():
 
 async def shutdown_event():
     logger.info("Shutting down...")
+    shutdown_text_pool()
     await Tortoise.close_connections()
 
 
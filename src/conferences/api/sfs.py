@@ -5,9 +5,9 @@ import os
 import uuid
 import datetime
 import pydantic
-from fastapi import Query
+from fastapi import Query, Header, Response
 
-from typing import Optional, Union
+from typing import Optional, Union, Dict
 
 from fastapi import HTTPException
 
@@ -40,8 +40,7 @@ async def verify_token(token):
         JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
         decoded = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
 
-        user = await controller.get_user(decoded['id_user'])
-        if not user:
+        if not await controller.is_known_user(decoded['id_user']):
             raise HTTPException(status_code=401,
                                 detail={"code": "INVALID_TOKEN", "message": "Invalid token, user not found"})
 
@@ -51,9 +50,14 @@ async def verify_token(token):
 
 
 class ConferenceImportRequestResponse(pydantic.BaseModel):
-    id: str
+    # id is None only in dry run of conference which is not imported yet
+    id: Optional[str]
     created: bool
     changes: dict
+    dry_run: Optional[bool] = False
+    preview: Optional[dict] = None
+    # unique ids of sessions deleted by the import, together with their bookmarks and rates
+    deleted_sessions: Optional[list] = None
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/authorize")
@@ -103,9 +107,7 @@ async def create_authorization_post():
 @app.post('/api/notification-token')
 async def store_notification_token(request: PushNotificationRequest, token: str = Depends(oauth2_scheme)):
     decoded = await verify_token(token)
-    user = await controller.get_user(decoded['id_user'])
-    user.push_notification_token = request.push_notification_token
-    await user.save()
+    await controller.store_notification_token(decoded['id_user'], request.push_notification_token)
 
 
 @app.get('/api/me')
@@ -113,11 +115,23 @@ async def get_me(token: str = Depends(oauth2_scheme)):
     return await verify_token(token)
 
 
+@app.get('/api/me/state')
+async def get_my_state(token: str = Depends(oauth2_scheme)):
+    decoded = await verify_token(token)
+    return await controller.get_user_state(decoded['id_user'], await controller.get_current_conference_header())
+
+
 class ImportConferenceRequest(pydantic.BaseModel):
     # use_local_xml: Optional[Union[bool, None]] = False
     use_local_xml: Optional[bool] = False
     local_xml_fname: Optional[str] = 'sfscon2024.xml'
     group_notifications_by_user: Optional[bool] = True
+    # without force, source is fetched conditionally and import is skipped if document was not changed
+    force: Optional[bool] = True
+    # only compare schedule with the database and report changes, nothing is written and no notification is sent
+    dry_run: Optional[bool] = False
+    # import of empty schedule or one deleting most of the sessions is refused unless allowed, independently of force
+    allow_deletions: Optional[bool] = False
 
 
 @app.post('/api/import-xml', response_model=ConferenceImportRequestResponse, )
@@ -125,27 +139,60 @@ async def import_conference_xml_api(request: ImportConferenceRequest = None):
     if request is None:
         request = ImportConferenceRequest()
 
-    content = await controller.fetch_xml_content(request.use_local_xml, request.local_xml_fname)
-    XML_URL = os.getenv("XML_URL", None)
-
-    try:
-        res = await controller.add_conference(content, XML_URL, force=True,
-                                              group_notifications_by_user=request.group_notifications_by_user)
-    except Exception as e:
-        raise
+    if request.dry_run:
+        # runs outside of import lock, it does not write anything
+        res = await controller.preview_conference_xml(use_local_xml=request.use_local_xml,
+                                                      local_xml_fname=request.local_xml_fname,
+                                                      group_notifications_by_user=request.group_notifications_by_user)
+
+        return ConferenceImportRequestResponse(id=str(res['conference'].id) if res['conference'] else None,
+                                               created=res['created'],
+                                               changes=res['changes'],
+                                               dry_run=True,
+                                               preview=res['preview'])
+
+    res = await controller.run_import(use_local_xml=request.use_local_xml,
+                                      local_xml_fname=request.local_xml_fname,
+                                      force=request.force,
+                                      group_notifications_by_user=request.group_notifications_by_user,
+                                      allow_deletions=request.allow_deletions)
     conference = res['conference']
 
-    return ConferenceImportRequestResponse(id=str(conference.id), created=res['created'], changes=res['changes'])
+    return ConferenceImportRequestResponse(id=str(conference.id), created=res['created'], changes=res['changes'],
+                                           deleted_sessions=res.get('deleted_sessions', []))
 
 
 @app.get('/api/conference')
 async def get_current_conference(last_updated: Optional[str] = Query(default=None),
+                                 if_none_match: Optional[str] = Header(default=None),
                                  token: str = Depends(oauth2_scheme)):
-    # return verify_token(token)
-
     decoded = await verify_token(token)
-    return await controller.opencon_serialize_anonymouse(decoded['id_user'], await controller.get_current_conference(),
-                                                         last_updated=last_updated)
+
+    etag, content = await controller.get_conference_for_user(decoded['id_user'],
+                                                             last_updated=last_updated,
+                                                             if_none_match=if_none_match)
+    if content is None:
+        return Response(status_code=304, headers={'ETag': etag})
+
+    return Response(content=content, media_type='application/json', headers={'ETag': etag})
+
+
+@app.get('/api/conference/schedule')
+async def get_current_conference_schedule(accept_encoding: Optional[str] = Header(default=None),
+                                          if_none_match: Optional[str] = Header(default=None),
+                                          token: str = Depends(oauth2_scheme)):
+    await verify_token(token)
+
+    etag, content_encoding, content = await controller.get_encoded_conference_schedule(accept_encoding)
+
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+    if controller.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if content_encoding != 'identity':
+        headers['Content-Encoding'] = content_encoding
+
+    return Response(content=content, media_type='application/json', headers=headers)
 
 
 class RateRequest(pydantic.BaseModel):
@@ -164,6 +211,30 @@ async def toggle_bookmark_for_session(id_session: uuid.UUID, token: str = Depend
     return await controller.bookmark_session(id_user=decoded['id_user'], id_session=id_session)
 
 
+@app.post('/api/sessions/{id_session}/bookmarks/set')
+async def set_bookmark_for_session(id_session: uuid.UUID, token: str = Depends(oauth2_scheme)):
+    decoded = await verify_token(token)
+    return await controller.set_bookmark(id_user=decoded['id_user'], id_session=id_session)
+
+
+@app.post('/api/sessions/{id_session}/bookmarks/unset')
+async def unset_bookmark_for_session(id_session: uuid.UUID, token: str = Depends(oauth2_scheme)):
+    decoded = await verify_token(token)
+    return await controller.unset_bookmark(id_user=decoded['id_user'], id_session=id_session)
+
+
+class SyncRequest(pydantic.BaseModel):
+    bookmarks: Optional[Dict[uuid.UUID, bool]] = {}
+    ratings: Optional[Dict[uuid.UUID, int]] = {}
+
+
+@app.post('/api/me/sync')
+async def sync_my_state(request: SyncRequest, token: str = Depends(oauth2_scheme)):
+    decoded = await verify_token(token)
+    return await controller.sync_user_state(id_user=decoded['id_user'], bookmarks=request.bookmarks,
+                                            ratings=request.ratings)
+
+
 class AdminLoginRequest(pydantic.BaseModel):
     username: str
     password: str
@@ -198,3 +269,15 @@ async def get_users_with_bookmarks(token: str = Depends(oauth2_scheme_admin)):
 async def get_sessions_by_rate(token: str = Depends(oauth2_scheme_admin)):
     await verify_admin_token(token)
     return {'data': await controller.get_sessions_by_rate()}
+
+
+@app.get('/api/admin/sessions_by_bookmarks')
+async def get_sessions_by_bookmarks(token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return {'data': await controller.get_sessions_by_bookmarks()}
+
+
+@app.get('/api/admin/assets')
+async def get_assets_stats(token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return {'data': controller.side_assets.stats()}
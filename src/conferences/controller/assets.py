@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import os
+import time
+import yaml
+import hashlib
+import logging
+
+log = logging.getLogger('conference_logger')
+current_file_dir = os.path.dirname(os.path.abspath(__file__))
+
+try:
+    YamlLoader = yaml.CSafeLoader
+except AttributeError:  # PyYAML built without LibYAML
+    YamlLoader = yaml.SafeLoader
+
+ASSETS_CHECK_INTERVAL = float(os.getenv('ASSETS_CHECK_INTERVAL', 5))
+ASSETS_DIR = os.getenv('ASSETS_DIR', current_file_dir + '/../../tests/assets')
+
+
+class YamlAsset:
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.data = None
+        self.version = 0
+        self.content_hash = None
+        self.last_reload_ms = None
+        self.total_reload_ms = 0.0
+
+    def reload_if_changed(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+
+        started = time.perf_counter()
+        with open(self.path, 'rb') as f:
+            content = f.read()
+
+        self.data = yaml.load(content, YamlLoader)
+        self.content_hash = hashlib.md5(content).hexdigest()
+        self.mtime = mtime
+        self.version += 1
+        self.last_reload_ms = (time.perf_counter() - started) * 1000
+        self.total_reload_ms += self.last_reload_ms
+
+        log.info(f'Asset {self.path} loaded in {self.last_reload_ms:.2f}ms (version {self.version})')
+        return True
+
+    def stats(self):
+        return {'path': self.path,
+                'version': self.version,
+                'content_hash': self.content_hash,
+                'last_reload_ms': self.last_reload_ms,
+                'total_reload_ms': self.total_reload_ms,
+                }
+
+
+class AssetRegistry:
+    """
+    Side assets (streaming links, sponsors, ...) kept in memory, file mtime is checked
+    at most once per ASSETS_CHECK_INTERVAL seconds and asset is reloaded only if file was changed.
+    Assets are loaded on first use, missing or invalid file is logged and asset keeps
+    its last good version (None until loaded).
+    """
+
+    def __init__(self, check_interval=ASSETS_CHECK_INTERVAL):
+        self.assets = {}
+        self.check_interval = check_interval
+        self.checked_at = 0
+
+    def register(self, name, path):
+        self.assets[name] = YamlAsset(path)
+        self.checked_at = 0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.check_interval:
+            return
+
+        self.checked_at = now
+        for asset in self.assets.values():
+            try:
+                asset.reload_if_changed()
+            except Exception as e:
+                # keep serving last good version
+                log.critical(f'Error reloading asset {asset.path} :: {str(e)}')
+
+    def get(self, name):
+        self.refresh()
+        return self.assets[name].data
+
+    @property
+    def version(self):
+        # derived from content, so it is the same in all processes and after restart
+        self.refresh()
+        return tuple(asset.content_hash for asset in self.assets.values())
+
+    def stats(self):
+        self.refresh()
+        return {name: asset.stats() for name, asset in self.assets.items()}
+
+
+side_assets = AssetRegistry()
+side_assets.register('streaming_links', ASSETS_DIR + '/sfs2023streaming.yaml')
+side_assets.register('sponsors', ASSETS_DIR + '/sfscon2024sponsors.yaml')
@@ -2,38 +2,52 @@
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
 import re
 import os
-import csv
-import yaml
 import uuid
+import gzip
 import json
-import redis
+import time
 import httpx
-import random
-import slugify
+import asyncio
 import logging
 import datetime
-import xmltodict
+import collections
+import xml.etree.ElementTree as ElementTree
 import tortoise.timezone
+import tortoise.exceptions
 
 from fastapi import HTTPException, status
+from tortoise.transactions import in_transaction
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, precompressed schedule is then available only as gzip
+    brotli = None
 
 import shared.ex as ex
+import shared.utils as utils
 import conferences.models as models
+from .assets import side_assets
+from .importer import diff_sessions, deletions_refused, apply_changes, ScheduleParser
+from .schedule_xml import ScheduleXmlStream
 
 log = logging.getLogger('conference_logger')
 current_file_dir = os.path.dirname(os.path.abspath(__file__))
 
 rlog = logging.getLogger('redis_logger')
-from tortoise.functions import Avg, Count
+from tortoise.functions import Count
+
+
+def new_conference(name, acronym, source_uri):
+    # not saved yet, conference is stored together with its schedule, see add_conference
+    return models.Conference(name=name, acronym=acronym, source_uri=source_uri)
 
 
-async def db_add_conference(name, acronym, source_uri):
+async def db_add_conference(conference, using_db=None):
     try:
-        conference = await models.Conference.create(name=name, acronym=acronym, source_uri=source_uri)
-        await models.Location.create(name='Noi Tech Park', slug='noi', conference=conference, )
+        await conference.save(using_db=using_db)
 
     except Exception as e:
-        log.critical(f'Error adding conference {name} {acronym} {source_uri} :: {str(e)}')
+        log.critical(f'Error adding conference {conference.name} {conference.acronym} {conference.source_uri} :: {str(e)}')
         raise
 
     try:
@@ -42,7 +56,8 @@ async def db_add_conference(name, acronym, source_uri):
             entrances = json.loads(entrances)
 
             for entrance in entrances:
-                await models.Entrance.create(name=entrance, id=entrances[entrance], conference=conference, )
+                await models.Entrance.create(name=entrance, id=entrances[entrance], conference=conference,
+                                             using_db=using_db)
 
     except Exception as e:
         log.critical(f'Error parsing ENTRANCES :: {str(e)}')
@@ -51,428 +66,130 @@ async def db_add_conference(name, acronym, source_uri):
     return conference
 
 
-async def read_xml_file(fname='sfscon2023.xml'):
-    with open(fname, 'r') as f:
-        content = xmltodict.parse(f.read(), encoding='utf-8')
-    return content['schedule']
-
-
-async def db_add_or_update_tracks(conference, content_tracks):
-    order = 0
-
-    tracks_by_name = {}
-    cvt = {'#text': 'name', '@color': 'color'}
-
-    for track in content_tracks['track']:
-        order += 1
-        defaults = {'conference': conference, 'order': order, 'color': 'black'}
-
-        # TODO: Remove this after Luka fix it in XML
-
-        if track == 'Main track - Main track':
-            track = 'Main track'
+XML_CHUNK_SIZE = 64 * 1024
 
-        if type(track) == str:
-            defaults['name'] = track
-        else:
-            for k, v in track.items():
-                if k in cvt:
-                    defaults[cvt[k]] = v
-
-        defaults['slug'] = slugify.slugify(defaults['name'])
-
-        try:
-            db_track = await models.Track.filter(conference=conference, name=defaults['name']).first()
-            if not db_track:
-                db_track = await models.Track.create(**defaults)
-            else:
-                await db_track.update_from_dict(defaults)
+# raw XML and parsed schedule of the last import are written to /tmp only if enabled
+IMPORT_DEBUG_DUMPS = os.getenv('IMPORT_DEBUG_DUMPS', 'false').lower() == 'true'
 
-        except Exception as e:
-            log.critical(f'Error adding track {defaults["name"]} :: {str(e)}')
-            raise
 
-        tracks_by_name[db_track.name] = db_track
+async def read_local_xml_chunks(fname):
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(XML_CHUNK_SIZE), b''):
+            yield chunk
 
-    if 'SFSCON' not in tracks_by_name:
-        db_track = await models.Track.filter(conference=conference, name='SFSCON').get_or_none()
-        if not db_track:
-            db_track = await models.Track.create(
-                **{'conference': conference, 'order': -1, 'name': f'SFSCON', 'slug': f'sfscon', 'color': 'black'})
 
-        tracks_by_name['SFSCON'] = db_track
+async def parse_xml_stream(chunks):
+    stream = ScheduleXmlStream()
+    parser = ScheduleParser()
 
-    return tracks_by_name
+    debug_file = open('/tmp/last_saved_xml.xml', 'wb') if IMPORT_DEBUG_DUMPS else None
+    try:
+        async for chunk in chunks:
+            if debug_file:
+                debug_file.write(chunk)
 
+            for record in stream.feed(chunk):
+                parser.add(record)
 
-async def convert_xml_to_dict(xml_text):
-    content = xmltodict.parse(xml_text, encoding='utf-8')
-    return content['schedule']
+        for record in stream.close():
+            parser.add(record)
+    except ElementTree.ParseError as e:
+        raise ex.AppException('ERROR_PARSING_XML', str(e))
+    finally:
+        if debug_file:
+            debug_file.close()
 
+    content = {'conference': parser.conference,
+               'tracks': parser.tracks,
+               'schedule': parser.schedule(),
+               'checksum': stream.checksum,
+               }
 
-def remove_html(text):
-    # return text
+    if IMPORT_DEBUG_DUMPS:
+        with open('/tmp/last_saved_json.json', 'wt') as f:
+            f.write(json.dumps(content, ensure_ascii=False, indent=1, default=str))
 
-    if not text:
-        return None
+    return content
 
-    for t in ('<br>', '<br/>', '<br />', '<p>', '</p>'):
-        text = text.replace(t, '\n')
 
-    for t in ('<b>', '<B>'):
-        if t in text:
-            text = text.replace(t, '|Text style={styles.bold}|')
+XML_FETCH_TIMEOUT = float(os.getenv('XML_FETCH_TIMEOUT', 30))
 
-    for t in ('<em>', '<EM>'):
-        if t in text:
-            text = text.replace(t, '|Text style={styles.italic}|')
+_http_client = None
+_http_client_loop = None
 
-    for t in ('</b>', '</B>', '</em>', '</EM>'):
-        if t in text:
-            text = text.replace(t, '|/Text|')
 
-    # Define a regular expression pattern to match HTML tags
-    pattern = re.compile('<.*?>')
+def get_http_client():
+    # one pooled client per event loop, keeps connection to schedule source alive between polls
+    global _http_client, _http_client_loop
 
-    # Use the pattern to remove all HTML tags
-    clean_text = re.sub(pattern, '', text)
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(timeout=XML_FETCH_TIMEOUT,
+                                         limits=httpx.Limits(max_connections=4, max_keepalive_connections=2))
+        _http_client_loop = loop
 
-    clean_text = clean_text.replace('|Text style={styles.bold}|', '<Text style={styles.bold}>')
-    clean_text = clean_text.replace('|Text style={styles.italic}|', '<Text style={styles.italic}>')
-    clean_text = clean_text.replace('|/Text|', '</Text>')
-    # Remove any extra whitespace
-    clean_text = ' '.join(clean_text.split())
+    return _http_client
 
-    return clean_text
 
+async def fetch_xml_content(use_local_xml=False, local_xml_fname='sfscon2024.xml', conditional=False):
+    """
+    Returns parsed schedule document, or None if request was conditional and
+    the source was not modified since the last import.
+    """
 
-async def fetch_xml_content(use_local_xml=False, local_xml_fname='sfscon2024.xml'):
     if use_local_xml:
         current_file_folder = os.path.dirname(os.path.realpath(__file__))
-        if use_local_xml:
-            with open(current_file_folder + f'/../../tests/assets/{local_xml_fname}', 'r') as f:
-                return await convert_xml_to_dict(f.read())
+        return await parse_xml_stream(read_local_xml_chunks(current_file_folder + f'/../../tests/assets/{local_xml_fname}'))
 
     XML_URL = os.getenv("XML_URL", None)
 
     if not XML_URL:
         raise ex.AppException('XML_URL_NOT_SET', 'XML_URL not set')
 
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.get(XML_URL)
-
-            if res.status_code != 200:
-                raise ex.AppException('ERROR_FETCHING_XML', XML_URL)
-
-            # for debugging purposes
-            with open('/tmp/last_saved_xml.xml', 'wt') as f:
-                f.write(res.text)
-
-            dict_content = await convert_xml_to_dict(res.text)
-            with open('/tmp/last_saved_json.json', 'wt') as f:
-                f.write(json.dumps(dict_content, ensure_ascii=False, indent=1))
-
-            return dict_content
-        except Exception as e:
-            log.critical(f'Error fetching XML from {XML_URL} :: {str(e)}')
-            raise
-
-
-async def add_sessions(conference, content, tracks_by_name):
-    db_location = await models.Location.filter(conference=conference, slug='noi').get_or_none()
-
-    changes = {}
-
-    await models.ConferenceLecturer.filter(conference=conference).delete()
-
-    def get_or_raise(key, obj):
-
-        if key == '@unique_id' and not '@unique_id' in obj:
-            return None
-
-        return obj[key]
-
-        # # TODO: Ubi ovo kad srede unique  - id obrisi od 143-145 linije
-        # if key == '@unique_id':
-        #     # if key not in obj:
-        #     return obj['@id']
-        #
-        # if key not in obj:
-        #     raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-        #                         detail=f"{key.upper()}_NOT_FOUND")
-        # return obj[key]
-
-    # test for duplicated unique_id
-
-    events_by_unique_id = {}
-
-    all_uids = set()
-    for day in content['day']:
-
-        for room in day['room']:
-            room_event = room['event']
-            if type(room_event) == dict:
-                room_event = [room_event]
-            for event in room_event:
-                if type(event) != dict:
-                    continue
-                unique_id = get_or_raise('@unique_id', event)
-                if not unique_id:
-                    continue
-
-                if unique_id in all_uids:
-                    continue
-
-                all_uids.add(unique_id)
-
-                if unique_id == '2023day1event5':
-                    ...
-                if unique_id in events_by_unique_id:
-                    raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                                        detail={"code": f"EVENT_UNIQUE_ID_ALREADY_EXISTS",
-                                                "message": f"Event {unique_id} already exists"})
-
-                events_by_unique_id[unique_id] = unique_id
-
-    all_uids = set()
-    for day in content['day']:
+    headers = {}
+    if conditional:
+        conference = await models.Conference.filter(source_uri=XML_URL).get_or_none()
+        if conference and conference.source_etag:
+            headers['If-None-Match'] = conference.source_etag
+        if conference and conference.source_last_modified:
+            headers['If-Modified-Since'] = conference.source_last_modified
 
-        date = day.get('@date', None)
-        if not date:
-            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                                detail={"code": "DAY_DATE_NOT_VALID", "message": "Day date is not valid"})
-
-        room_by_name = {}
-
-        for room in day['room']:
-
-            room_name = room.get('@name', None)
-
-            if not room_name:
-                raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                                    detail={"code": "ROOM_NAME_NOT_VALID", "message": "Room name is not valid"})
-
-            room_slug = slugify.slugify(room_name)
-
-            db_room = await models.Room.filter(conference=conference,
-                                               location=db_location,
-                                               slug=room_slug).first()
-
-            if not db_room:
-                db_room = await models.Room.create(conference=conference,
-                                                   location=db_location,
-                                                   name=room_name, slug=room_slug)
-
-            if db_room.name not in room_by_name:
-                room_by_name[db_room.name] = db_room
-
-            room_event = room['event']
-            if type(room_event) == dict:
-                room_event = [room_event]
-            for event in room_event:
-
-                # try:
-                #     if event['@id'] == '654a0e4cbd1d807a6ed7109ee6dc4ddb16ef4048a852e':
-                #         print("\nFIND FSFE\n")
-                # except Exception as e:
-                #     ...
-                # else:
-                #     ...
-                # print(event['title'])
-
-                if type(event) != dict:
-                    continue
-                unique_id = get_or_raise('@unique_id', event)
-                if not unique_id:
-                    continue
+    try:
+        async with get_http_client().stream('GET', XML_URL, headers=headers) as res:
 
-                if unique_id in all_uids:
-                    continue
+            if res.status_code == 304:
+                log.info(f'XML {XML_URL} not modified')
+                return None
 
-                all_uids.add(unique_id)
+            if res.status_code != 200:
+                raise ex.AppException('ERROR_FETCHING_XML', XML_URL)
 
-                title = get_or_raise('title', event)
-                try:
-                    url = get_or_raise('url', event)
-                except Exception as e:
-                    url = None
+            content = await parse_xml_stream(res.aiter_bytes(XML_CHUNK_SIZE))
 
-                slug = slugify.slugify(title)
-                track_name = event.get('track', None)
-                if type(track_name) == dict:
-                    track_name = track_name['#text']
+            content['etag'] = res.headers.get('ETag', None)
+            content['last_modified'] = res.headers.get('Last-Modified', None)
 
-                # TODO: Remove this after Luka fix it in XML
+            return content
+    except Exception as e:
+        log.critical(f'Error fetching XML from {XML_URL} :: {str(e)}')
+        raise
 
-                if track_name in ('SFSCON - Main track', 'Main track - Main track'):
-                    track_name = 'SFSCON'  # 'Main track'
 
-                track = tracks_by_name[track_name] if track_name and track_name in tracks_by_name else None
-                # event_type = event.get('@type', None)
-                event_start = event.get('start', None)
-                description = event.get('description', None)
-                abstract = event.get('abstract', None)
+async def import_conference_xml(use_local_xml=False, local_xml_fname='sfscon2024.xml', force=True,
+                                group_notifications_by_user=True, allow_deletions=False):
+    XML_URL = os.getenv("XML_URL", None)
 
-                # no_bookmark = event.get('@bookmark', False)
-                can_bookmark = event.get('@bookmark', "0") == "1"
-                can_rate = event.get('@rating', "0") == "1"
+    content = await fetch_xml_content(use_local_xml, local_xml_fname, conditional=not force and not use_local_xml)
 
-                if not can_bookmark:
-                    ...
-                else:
-                    ...
-
-                if event_start and len(event_start) == 5:
-                    event_start = datetime.datetime(year=int(date[0:4]),
-                                                    month=int(date[5:7]),
-                                                    day=int(date[8:10]),
-                                                    hour=int(event_start[0:2]),
-                                                    minute=int(event_start[3:5]))
-                else:
-                    event_start = None
+    if content is None:
+        return {'conference': await models.Conference.filter(source_uri=XML_URL).get(),
+                'created': False,
+                'changes': {},
+                'not_modified': True,
+                }
 
-                event_duration = event.get('duration', None)
-                if event_duration and len(event_duration) == 5:
-                    event_duration = int(event_duration[0:2]) * 60 * 60 + int(event_duration[3:5]) * 60
-                else:
-                    event_duration = None
-
-                try:
-                    track_name = track.name
-                    room_name = db_room.name
-
-                    if room_name == 'Seminar 2':
-                        event_start += datetime.timedelta(milliseconds=1)
-                    if room_name == 'Seminar 3':
-                        event_start += datetime.timedelta(milliseconds=2)
-                    if room_name == 'Seminar 4':
-                        event_start += datetime.timedelta(milliseconds=3)
-                    if room_name.startswith('Auditorium'):
-                        event_start += datetime.timedelta(milliseconds=4)
-
-                    db_event = await models.EventSession.filter(conference=conference, unique_id=unique_id).first()
-                    # print("db_event", db_event)
-                    if unique_id == '2023day1event5':
-                        ...
-
-                    str_start_time = event_start.strftime('%Y-%m-%d %H:%M:%S') if event_start else None
-
-                    if not db_event:
-                        db_event = await models.EventSession.create(conference=conference,
-                                                                    title=title,
-                                                                    url=url,
-                                                                    abstract=abstract,
-                                                                    description=remove_html(description),
-                                                                    unique_id=unique_id,
-                                                                    bookmarkable=can_bookmark,
-                                                                    rateable=can_rate,
-                                                                    track=track,
-                                                                    room=db_room,
-                                                                    str_start_time=str_start_time,
-                                                                    start_date=event_start,
-                                                                    duration=event_duration,
-                                                                    end_date=event_start + datetime.timedelta(
-                                                                        seconds=event_duration) if event_start and event_duration else None,
-                                                                    )
-
-                        # await models.StarredSession.create(event_session=db_event,
-                        #                                    nr_votes=0,
-                        #                                    total_stars=0,
-                        #                                    avg_stars=0)
-                    else:
-
-                        event_start = tortoise.timezone.make_aware(event_start)
-                        if event_start != db_event.start_date:
-                            changes[str(db_event.id)] = {'old_start_timestamp': db_event.start_date,
-                                                         'new_start_timestamp': event_start}
-
-                        await db_event.update_from_dict({'title': title, 'abstract': abstract,
-                                                         'description': description,
-                                                         'unique_id': unique_id,
-                                                         'bookmarkable': can_bookmark,
-                                                         'rateable': can_rate,
-                                                         'track': track,
-                                                         'db_room': db_room,
-                                                         'str_start_time': str_start_time,
-                                                         'start_date': event_start,
-                                                         'end_date': event_start + datetime.timedelta(
-                                                             seconds=event_duration) if event_start and event_duration else None})
-
-                        await db_event.save()
-
-                except Exception as e:
-                    log.critical(f'Error adding event {title} :: {str(e)}')
-                    raise
-
-                persons = event.get('persons', [])
-
-                if persons:
-                    persons = persons['person']
-
-                    if type(persons) == dict:
-                        persons = [persons]
-
-                    event_persons = []
-
-                    for person in persons:
-
-                        try:
-                            db_person = await models.ConferenceLecturer.filter(conference=conference,
-                                                                               external_id=person['@id']).get_or_none()
-                        except Exception as e:
-                            log.critical(f'Error adding person {person["#text"]} :: {str(e)}')
-                            raise
-
-                        display_name = person['#text']
-                        # bio = person.get('@bio', None)
-
-                        bio = models.ConferenceLecturer.fix_bio(person.get('@bio', None))
-
-                        pid = person.get('@id', None)
-                        organization = person.get('@organization', None)
-                        thumbnail_url = person.get('@thumbnail', None)
-                        first_name = display_name.split(' ')[0].capitalize()
-                        last_name = ' '.join(display_name.split(' ')[1:]).capitalize()
-                        social_networks = person.get('@socials', None)
-                        social_networks = json.loads(social_networks) if social_networks else []
-
-                        if not db_person:
-                            try:
-                                db_person = await models.ConferenceLecturer.create(conference=conference,
-                                                                                   external_id=pid,
-                                                                                   bio=remove_html(bio),
-                                                                                   social_networks=social_networks,
-                                                                                   first_name=first_name,
-                                                                                   last_name=last_name,
-                                                                                   display_name=display_name,
-                                                                                   thumbnail_url=thumbnail_url,
-                                                                                   slug=slugify.slugify(display_name),
-                                                                                   organization=organization,
-                                                                                   )
-                            except Exception as e:
-                                log.critical(f'Error adding person {person["#text"]} :: {str(e)}')
-                                raise
-                        else:
-                            await db_person.update_from_dict({'bio': remove_html(bio),
-                                                              'social_networks': social_networks,
-                                                              'first_name': first_name,
-                                                              'last_name': last_name,
-                                                              'display_name': display_name,
-                                                              'thumbnail_url': thumbnail_url,
-                                                              'slug': slugify.slugify(display_name),
-                                                              'organization': organization,
-                                                              })
-
-                            await db_person.save()
-
-                        event_persons.append(db_person)
-
-                    if event_persons:
-                        await db_event.fetch_related('lecturers')
-                        await db_event.lecturers.add(*event_persons)
-
-    return changes
+    return await add_conference(content, XML_URL, force=force, group_notifications_by_user=group_notifications_by_user,
+                                allow_deletions=allow_deletions)
 
 
 async def send_changes_to_bookmakers(changes, group_4_user=True):
@@ -576,40 +293,74 @@ async def send_changes_to_bookmakers(changes, group_4_user=True):
                 redis_client.push_message('opencon_push_notification', pn_payload)
 
 
-async def add_conference(content: dict, source_uri: str, force: bool = False, group_notifications_by_user=True):
-    conference = await models.Conference.filter(source_uri=source_uri).get_or_none()
+async def save_source_validators(conference: models.Conference, content: dict):
+    if (conference.source_etag, conference.source_last_modified) == (content.get('etag', None),
+                                                                     content.get('last_modified', None)):
+        return
+
+    conference.source_etag = content.get('etag', None)
+    conference.source_last_modified = content.get('last_modified', None)
+    await conference.save(update_fields=['source_etag', 'source_last_modified'])
 
-    created = False
-    if not conference:
-        created = True
-        conference = await db_add_conference(content['conference']['title'],
-                                             content['conference']['acronym'],
-                                             source_uri=source_uri
-                                             )
 
-    import shared.utils as utils
-    checksum = utils.calculate_md5_checksum_for_dict(content)
+async def add_conference(content: dict, source_uri: str, force: bool = False, group_notifications_by_user=True,
+                         allow_deletions: bool = False):
+    conference = await models.Conference.filter(source_uri=source_uri).get_or_none()
+
+    created = conference is None
+    checksum = content['checksum']
 
-    if not force and conference.source_document_checksum == checksum:
+    if not created and not force and conference.source_document_checksum == checksum:
+        await save_source_validators(conference, content)
         return {'conference': conference,
                 'created': False,
                 'changes': {},
                 'checksum_matches': True,
                 }
-    else:
-        conference.source_document_checksum = checksum
-        await conference.save()
 
-    content_tracks = content.get('tracks', [])
+    if created:
+        conference = new_conference(content['conference']['title'],
+                                    content['conference']['acronym'],
+                                    source_uri=source_uri)
 
-    tracks_by_name = await db_add_or_update_tracks(conference, content_tracks)
-    try:
-        changes = await add_sessions(conference, content, tracks_by_name)
-    except Exception as e:
-        raise
+    # whole change set, including missing location, tracks and rooms, is prepared before anything is written
+    changes = await diff_sessions(conference, content, created)
 
-    if created:
-        changes = {}
+    # force only skips the checksum check, deleting sessions (with their bookmarks and rates)
+    # in bulk has to be allowed explicitly
+    refused = None if allow_deletions else deletions_refused(changes)
+    if refused:
+        log.error(f'Schedule of {conference.acronym} not imported :: {refused["message"]}')
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=refused)
+
+    # checksum and validators are stored only with successfully imported schedule,
+    # otherwise failed import would never be retried
+    conference.source_document_checksum = checksum
+    conference.source_etag = content.get('etag', None)
+    conference.source_last_modified = content.get('last_modified', None)
+
+    # schedule is written in one transaction together with last_updated bump, so clients and
+    # cached snapshot never see partially imported schedule
+    async with in_transaction() as connection:
+        if created:
+            await db_add_conference(conference, using_db=connection)
+
+        await apply_changes(changes, connection)
+
+        if not created:
+            await conference.save(update_fields=['source_document_checksum', 'last_updated', 'source_etag',
+                                                 'source_last_modified'], using_db=connection)
+
+    deleted_sessions = sorted(session.unique_id for session in changes.deleted_sessions)
+
+    log.info(f'Schedule of {conference.acronym} imported :: {changes.summary()}')
+    if deleted_sessions:
+        log.warning(f'Schedule of {conference.acronym} imported :: deleted sessions {", ".join(deleted_sessions)}')
+
+    invalidate_conference_snapshot()
+    invalidate_session_index()
+
+    changes = {} if created else changes.rescheduled
 
     changes_updated = None
     if changes:
@@ -619,10 +370,61 @@ async def add_conference(content: dict, source_uri: str, force: bool = False, gr
             'created': created,
             'checksum_matches': False,
             'changes': changes,
-            'changes_updated': changes_updated
+            'changes_updated': changes_updated,
+            'deleted_sessions': deleted_sessions,
+            }
+
+
+async def count_push_notifications(changes, group_4_user=True):
+    # number of notifications send_changes_to_bookmakers would send for these changes
+    if not changes:
+        return 0
+
+    id_users = await models.AnonymousBookmark.filter(session_id__in=list(changes.keys()),
+                                                     user__push_notification_token__isnull=False
+                                                     ).values_list('user_id', flat=True)
+
+    return len(set(id_users)) if group_4_user else len(id_users)
+
+
+async def preview_conference(content: dict, source_uri: str, group_notifications_by_user=True):
+    """
+    Dry run of add_conference, schedule is compared with the database in memory and nothing is written,
+    conference which is not imported yet is compared as empty.
+    """
+
+    conference = await models.Conference.filter(source_uri=source_uri).get_or_none()
+
+    created = conference is None
+    if created:
+        conference = new_conference(content['conference']['title'],
+                                    content['conference']['acronym'],
+                                    source_uri=source_uri)
+
+    changes = await diff_sessions(conference, content, created)
+
+    preview = changes.report()
+    preview['push_notifications'] = 0 if created else await count_push_notifications(
+        changes.rescheduled, group_4_user=group_notifications_by_user)
+    preview['requires_allow_deletions'] = deletions_refused(changes)
+
+    return {'conference': None if created else conference,
+            'created': created,
+            'checksum_matches': not created and conference.source_document_checksum == content['checksum'],
+            'changes': {} if created else changes.rescheduled,
+            'preview': preview,
             }
 
 
+async def preview_conference_xml(use_local_xml=False, local_xml_fname='sfscon2024.xml',
+                                 group_notifications_by_user=True):
+    XML_URL = os.getenv("XML_URL", None)
+
+    content = await fetch_xml_content(use_local_xml, local_xml_fname)
+
+    return await preview_conference(content, XML_URL, group_notifications_by_user=group_notifications_by_user)
+
+
 async def get_conference_sessions(conference_acronym):
     conference = await models.Conference.filter(acronym=conference_acronym).get_or_none()
     if not conference:
@@ -697,7 +499,7 @@ async def get_pretix_order(conference: models.Conference, id_pretix_order: str):
 
 
 async def get_all_anonymous_users_with_bookmarked_sessions():
-    conference = await get_current_conference()
+    conference = await get_current_conference_header()
     if not conference:
         raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
@@ -707,23 +509,42 @@ async def get_all_anonymous_users_with_bookmarked_sessions():
 
 
 async def get_sessions_by_rate():
-    conference = await get_current_conference()
+    conference = await get_current_conference_header()
     if not conference:
         raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
-    all_sessions = await models.EventSession.filter(
-        conference=conference
-    ).annotate(
-        avg_rate=Avg('anonymous_rates__rate'),
-        rates_count=Count('anonymous_rates')
-    ).order_by('avg_rate', 'title').prefetch_related('anonymous_rates').all()
+    all_sessions = await models.EventSession.filter(conference=conference).prefetch_related('rates_aggregate')
+
+    res = []
+    for session in all_sessions:
+        aggregate = session.rates_aggregate
+        nr_votes = aggregate.nr_votes if aggregate else 0
+        res.append({'title': session.title,
+                    'rates': nr_votes,
+                    'avg_rate': aggregate.avg_rate if nr_votes else None,
+                    })
+
+    return sorted(res, key=lambda s: (s['avg_rate'] is None, s['avg_rate'] or 0, s['title']))
+
+
+async def get_bookmarks_by_session(conference):
+    bookmarks = await models.AnonymousBookmark.filter(session__conference_id=conference.id).annotate(
+        nr_bookmarks=Count('id')).group_by('session_id').values('session_id', 'nr_bookmarks')
+
+    return {str(b['session_id']): b['nr_bookmarks'] for b in bookmarks}
+
+
+async def get_sessions_by_bookmarks():
+    conference = await get_current_conference_header()
+
+    bookmarks_by_session = await get_bookmarks_by_session(conference)
+    all_sessions = await models.EventSession.filter(conference=conference).values('id', 'title')
+
+    res = [{'title': session['title'],
+            'bookmarks': bookmarks_by_session.get(str(session['id']), 0)
+            } for session in all_sessions]
 
-    # all_sessions = await models.EventSession.filter(conference=conference).prefetch_related('anonymous_rates').all()
-    return [{'title': session.title,
-             'rates': len(session.anonymous_rates),
-             'avg_rate': sum([r.rate for r in session.anonymous_rates]) / len(
-                 session.anonymous_rates) if session.anonymous_rates else None
-             } for session in all_sessions]
+    return sorted(res, key=lambda s: (-s['bookmarks'], s['title']))
 
 
 async def get_current_conference():
@@ -739,11 +560,16 @@ async def get_current_conference():
                                                                    'lecturers',
                                                                    'lecturers__event_sessions',
                                                                    # 'event_sessions__starred_session',
+                                                                   ).order_by('-created').first()
 
-                                                                   'event_sessions__anonymous_bookmarks',
-                                                                   'event_sessions__anonymous_rates',
+    if not conference:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"code": "CONFERENCE_NOT_FOUND", "message": "conference not found"})
+    return conference
 
-                                                                   ).order_by('-created').first()
+
+async def get_current_conference_header():
+    conference = await models.Conference.filter().order_by('-created').first()
 
     if not conference:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -751,33 +577,289 @@ async def get_current_conference():
     return conference
 
 
-#
-# async def get_conference(id_conference: uuid.UUID):
-#     conference = await models.Conference.filter(id=id_conference).prefetch_related('tracks',
-#                                                                                    'locations',
-#                                                                                    'event_sessions',
-#                                                                                    'event_sessions__track',
-#                                                                                    'event_sessions__room',
-#                                                                                    # 'event_sessions__room__location',
-#                                                                                    'event_sessions__lecturers',
-#                                                                                    'rooms',
-#                                                                                    # 'rooms__location',
-#                                                                                    'lecturers',
-#                                                                                    'lecturers__event_sessions',
-#                                                                                    # 'event_sessions__starred_session',
-#
-#                                                                                    'event_sessions__anonymous_bookmarks',
-#                                                                                    'event_sessions__anonymous_rates',
-#
-#                                                                                    ).get_or_none()
-#
-#     return conference
+class ConferenceSnapshot:
+    """
+    User independent part of the /api/conference payload (the 'db' / 'idx' document).
+
+    Snapshot is valid as long as conference.last_updated is unchanged, which happens only when
+    the schedule is imported again.
+    """
+
+    def __init__(self, conference: models.Conference, document: dict, assets_version: tuple = None):
+        self.id_conference = str(conference.id)
+        self.last_updated = conference.last_updated
+        self.db_last_updated = str(tortoise.timezone.make_naive(conference.last_updated))
+        self.checksum = conference.source_document_checksum
+        self.document = document
+        self.assets_version = assets_version
+        self.validated_at = time.monotonic()
+
+        self.document_json = None
+        self.encoded_schedule = {}
+        self.compressing = {}
+
+    def encode(self):
+        # called once per snapshot outside of event loop, compressed versions are made on first request
+        self.document_json = json.dumps(self.document, ensure_ascii=False, separators=(',', ':'),
+                                        default=str).encode('utf-8')
+
+        self.encoded_schedule['identity'] = b'{"last_updated":' + json.dumps(self.db_last_updated).encode('utf-8') + \
+                                            b',"conference":' + self.document_json + b'}'
+
+    def compress(self, encoding):
+        # CPU heavy, outside of event loop
+        schedule = self.encoded_schedule['identity']
+        if encoding == 'br':
+            encoded = brotli.compress(schedule, quality=SCHEDULE_BROTLI_QUALITY)
+        else:
+            encoded = gzip.compress(schedule, compresslevel=SCHEDULE_GZIP_LEVEL, mtime=0)
+
+        log.info(f'Conference schedule encoded, {encoding}: {len(encoded)} bytes')
+        return encoded
+
+    async def encoded(self, encoding):
+        if encoding not in self.encoded_schedule:
+            # one compression per encoding, concurrent requests wait for it
+            if encoding not in self.compressing:
+                self.compressing[encoding] = asyncio.get_running_loop().run_in_executor(None, self.compress, encoding)
+
+            # request may be cancelled, compression is kept for the others
+            self.encoded_schedule[encoding] = await asyncio.shield(self.compressing[encoding])
+
+        return self.encoded_schedule[encoding]
+
+    def schedule_etag(self, encoding):
+        return '"' + utils.calculate_md5_checksum_for_string(
+            f'{SCHEDULE_FORMAT_VERSION}|{self.checksum}|{self.db_last_updated}|{self.assets_version}') + \
+            ('' if encoding == 'identity' else f'-{encoding}') + '"'
+
+    def matches(self, conference: models.Conference):
+        return self.id_conference == str(conference.id) and \
+            self.last_updated == conference.last_updated and \
+            self.assets_version == side_assets.version
+
+    def is_fresh(self):
+        # import may run in other process, so snapshot is trusted without looking into database only for a while
+        return time.monotonic() - self.validated_at < CONFERENCE_SNAPSHOT_TTL
+
+    def etag(self, id_user, state_version, lite: bool):
+        ratings_version, user_version = state_version
+        return '"' + utils.calculate_md5_checksum_for_string(
+            f'{SCHEDULE_FORMAT_VERSION}|{self.checksum}|{self.db_last_updated}|{self.assets_version}|'
+            f'{ratings_version}|{id_user}|{user_version}|{int(lite)}') + '"'
+
+
+CONFERENCE_SNAPSHOT_TTL = float(os.getenv('CONFERENCE_SNAPSHOT_TTL', 5))
+# etags are derived from content only, so they survive restarts and are the same on all instances,
+# bump it when serialization of the conference document changes
+SCHEDULE_FORMAT_VERSION = 1
+# brotli 11 takes most of a second for the schedule, 5 is still smaller than gzip 9 and faster
+SCHEDULE_BROTLI_QUALITY = int(os.getenv('SCHEDULE_BROTLI_QUALITY', 5))
+SCHEDULE_GZIP_LEVEL = int(os.getenv('SCHEDULE_GZIP_LEVEL', 9))
+
+_conference_snapshot = None
+_conference_snapshot_lock = asyncio.Lock()
+
+def invalidate_conference_snapshot():
+    global _conference_snapshot
+    _conference_snapshot = None
+
+
+# versions of data which are not part of snapshot, stored in database so they are shared by all instances,
+# bumped after every committed write, so etag with new version is never computed from older state
+BUMP_USER_STATE_VERSION_SQL = \
+    """
+    UPDATE conferences_users_anonymous SET state_version = state_version + 1 WHERE id = $1
+    """
+
+BUMP_RATINGS_VERSION_SQL = \
+    """
+    UPDATE conferences SET ratings_version = ratings_version + 1
+    WHERE id = (SELECT id FROM conferences ORDER BY created DESC LIMIT 1)
+    """
+
+# conference header and both versions with one lookup, no row if there is no conference or user
+CONFERENCE_STATE_VERSION_SQL = \
+    """
+    SELECT c.id, c.last_updated, c.ratings_version, u.state_version
+    FROM conferences c, conferences_users_anonymous u
+    WHERE u.id = $1
+    ORDER BY c.created DESC LIMIT 1
+    """
+
+
+async def bump_user_state_version(id_user, ratings_changed=False):
+    db = models.UserAnonymous._meta.db
+    await db.execute_query(BUMP_USER_STATE_VERSION_SQL, [str(id_user)])
+    if ratings_changed:
+        await db.execute_query(BUMP_RATINGS_VERSION_SQL)
+
+
+async def get_user_state_version(id_user):
+    _, rows = await models.UserAnonymous._meta.db.execute_query(CONFERENCE_STATE_VERSION_SQL, [str(id_user)])
+    return rows[0] if rows else None
+
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match or not etag:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    return etag in [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+
+
+async def get_conference_snapshot(conference: models.Conference):
+    global _conference_snapshot
+
+    snapshot = _conference_snapshot
+    if snapshot and snapshot.matches(conference):
+        snapshot.validated_at = time.monotonic()
+        return snapshot
+
+    # only one request rebuilds the snapshot, others are waiting for it
+    async with _conference_snapshot_lock:
+        snapshot = _conference_snapshot
+        if snapshot and snapshot.matches(conference):
+            return snapshot
+
+        full_conference = await get_current_conference()
+        assets_version = side_assets.version
+        snapshot = ConferenceSnapshot(full_conference, serialize_conference_document(full_conference),
+                                      assets_version=assets_version)
+        await asyncio.get_running_loop().run_in_executor(None, snapshot.encode)
+        _conference_snapshot = snapshot
+
+        log.info(f'Conference snapshot rebuilt for {snapshot.id_conference} / {snapshot.db_last_updated}')
+
+    return snapshot
+
+
+async def get_current_conference_snapshot():
+    snapshot = _conference_snapshot
+    if snapshot and snapshot.is_fresh():
+        return snapshot
+
+    return await get_conference_snapshot(await get_current_conference_header())
+
+
+def choose_content_encoding(accept_encoding: str):
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0
+        accepted[name.strip().lower()] = q
+
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and not brotli:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+
+    return 'identity'
+
+
+async def get_encoded_conference_schedule(accept_encoding=None):
+    """
+    Returns (etag, content_encoding, body) of user independent schedule document, body is already encoded
+    """
+
+    snapshot = await get_current_conference_snapshot()
+    encoding = choose_content_encoding(accept_encoding)
+
+    return snapshot.schedule_etag(encoding), encoding, await snapshot.encoded(encoding)
+
+
+def encode_conference_payload(payload, snapshot: ConferenceSnapshot):
+    # serialized conference document is reused from snapshot, only per user part is dumped on each request
+    envelope = dict(payload)
+    document = envelope.pop('conference')
+
+    body = json.dumps(envelope, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+    if document is None:
+        document_json = b'null'
+    elif document is snapshot.document and snapshot.document_json:
+        document_json = snapshot.document_json
+    else:
+        document_json = json.dumps(document, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+    return body[:-1] + b',"conference":' + document_json + b'}'
+
+
+async def get_conference_for_user(id_user, last_updated=None, if_none_match=None):
+    """
+    Returns (etag, body) for /api/conference, body is None when client already has current version
+    """
+
+    # version has to be taken before reading, so concurrent write can only make etag older than payload
+    state = await get_user_state_version(id_user)
+    state_version = (state['ratings_version'], state['state_version']) if state else None
+
+    snapshot = _conference_snapshot
+    if state and snapshot and snapshot.id_conference == str(state['id']) and \
+            snapshot.last_updated == state['last_updated'] and snapshot.assets_version == side_assets.version:
+        lite = bool(last_updated and last_updated >= snapshot.db_last_updated)
+        etag = snapshot.etag(id_user, state_version, lite)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+
+    conference = await get_current_conference_header()
+    snapshot = await get_conference_snapshot(conference)
+
+    payload = await opencon_serialize_anonymouse(id_user, conference, last_updated=last_updated)
+
+    etag = snapshot.etag(id_user, state_version, lite=payload['conference'] is None)
+    if etag_matches(if_none_match, etag):
+        return etag, None
+
+    return etag, encode_conference_payload(payload, snapshot)
+
+
+# users seen recently, signed token of a known user is accepted without a database round-trip
+KNOWN_USERS_TTL = float(os.getenv('KNOWN_USERS_TTL', 3600))
+KNOWN_USERS_MAX_SIZE = int(os.getenv('KNOWN_USERS_MAX_SIZE', 100000))
+_known_users = collections.OrderedDict()
+
+
+def remember_user(id_user):
+    id_user = str(id_user)
+    _known_users[id_user] = time.monotonic() + KNOWN_USERS_TTL
+    _known_users.move_to_end(id_user)
+
+    while len(_known_users) > KNOWN_USERS_MAX_SIZE:
+        _known_users.popitem(last=False)
+
+
+def forget_user(id_user):
+    _known_users.pop(str(id_user), None)
+
+
+async def is_known_user(id_user):
+    expires = _known_users.get(str(id_user))
+    if expires and expires > time.monotonic():
+        return True
+
+    if not await models.UserAnonymous.filter(id=id_user).exists():
+        forget_user(id_user)
+        return False
+
+    remember_user(id_user)
+    return True
 
 
 async def authorize_user(push_notification_token: str = None):
     # log.info(f"AUTHORIZING NEW ANONYMOUS USER push_notification_token={push_notification_token}")
     anonymous = models.UserAnonymous()  # push_notification_token=push_notification_token)
     await anonymous.save()
+    remember_user(anonymous.id)
     return str(anonymous.id)
 
 
@@ -785,54 +867,152 @@ async def get_user(id_user: uuid.UUID):
     return await models.UserAnonymous.filter(id=id_user).get_or_none()
 
 
-async def bookmark_session(id_user, id_session):
-    user = await models.UserAnonymous.filter(id=id_user).get_or_none()
-    if not user:
+async def store_notification_token(id_user, push_notification_token):
+    updated = await models.UserAnonymous.filter(id=id_user).update(push_notification_token=push_notification_token)
+    if not updated:
+        forget_user(id_user)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail={"code": "USER_NOT_FOUND", "message": "user not found"})
 
-    session = await models.EventSession.filter(id=id_session).get_or_none()
-    if not session:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail={"code": "SESSION_NOT_FOUND", "message": "session not found"})
 
+def not_found_for_integrity_error(e: tortoise.exceptions.IntegrityError, id_user):
+    # postgres names foreign key constraints <table>_<column>_fkey
+    constraint = getattr(e.args[0] if e.args else None, 'constraint_name', None) or ''
+
+    if constraint.endswith('_session_id_fkey'):
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                             detail={"code": "SESSION_NOT_FOUND", "message": "session not found"})
+
+    if constraint.endswith('_user_id_fkey'):
+        forget_user(id_user)
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                             detail={"code": "USER_NOT_FOUND", "message": "user not found"})
+
+    return e
+
+
+async def set_bookmark(id_user, id_session):
+    # INSERT ... ON CONFLICT DO NOTHING on (user, session), repeated set is a no-op
     try:
-        current_bookmark = await models.AnonymousBookmark.filter(user=user, session=session).get_or_none()
-    except Exception as e:
-        raise
+        await models.AnonymousBookmark.bulk_create([models.AnonymousBookmark(user_id=id_user, session_id=id_session)],
+                                                   ignore_conflicts=True)
+    except tortoise.exceptions.IntegrityError as e:
+        raise not_found_for_integrity_error(e, id_user)
+
+    await bump_user_state_version(id_user)
+    return {'bookmarked': True}
+
+
+async def unset_bookmark(id_user, id_session):
+    deleted = await models.AnonymousBookmark.filter(user_id=id_user, session_id=id_session).delete()
+    if deleted:
+        await bump_user_state_version(id_user)
 
-    if not current_bookmark:
-        await models.AnonymousBookmark.create(user=user, session=session)
-        return {'bookmarked': True}
-    else:
-        await current_bookmark.delete()
     return {'bookmarked': False}
 
 
+async def bookmark_session(id_user, id_session):
+    # toggle, kept for older clients
+    deleted = await models.AnonymousBookmark.filter(user_id=id_user, session_id=id_session).delete()
+    if deleted:
+        await bump_user_state_version(id_user)
+        return {'bookmarked': False}
+
+    return await set_bookmark(id_user, id_session)
+
+
 def now():
     return datetime.datetime.now()
 
 
-async def rate_session(id_user, id_session, rate):
-    if rate < 1 or rate > 5:
-        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                            detail={"code": "RATE_NOT_VALID", "message": "rate not valid, use number between 1 and 5"})
+# rateable flag and start time of sessions of the current conference, used to validate
+# ratings without reading the session; rebuilt when the conference is imported again
+_session_index = None
+
+
+def invalidate_session_index():
+    global _session_index
+    _session_index = None
 
-    user = await models.UserAnonymous.filter(id=id_user).get_or_none()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail={"code": "USER_NOT_FOUND", "message": "user not found"})
 
-    session = await models.EventSession.filter(id=id_session).get_or_none()
+async def get_session_index():
+    global _session_index
+
+    index = _session_index
+    if index and time.monotonic() - index['validated_at'] < CONFERENCE_SNAPSHOT_TTL:
+        return index
+
+    conference = await get_current_conference_header()
+    if index and index['id_conference'] == str(conference.id) and index['last_updated'] == conference.last_updated:
+        index['validated_at'] = time.monotonic()
+        return index
+
+    sessions = await models.EventSession.filter(conference=conference).values('id', 'rateable', 'start_date')
+
+    _session_index = {'id_conference': str(conference.id),
+                      'last_updated': conference.last_updated,
+                      'validated_at': time.monotonic(),
+                      'sessions': {str(s['id']): (s['rateable'], s['start_date']) for s in sessions}
+                      }
+    return _session_index
+
+
+async def get_session_meta(id_session):
+    meta = (await get_session_index())['sessions'].get(str(id_session))
+    if meta:
+        return meta
+
+    # session of some older conference
+    session = await models.EventSession.filter(id=id_session).values('rateable', 'start_date')
     if not session:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail={"code": "SESSION_NOT_FOUND", "message": "session not found"})
 
-    if not session.rateable:
+    return session[0]['rateable'], session[0]['start_date']
+
+
+RATE_SESSION_SQL = \
+    """
+    WITH previous AS (
+        SELECT rate FROM conferences_anonymous_rates WHERE user_id = $1 AND session_id = $2
+    ), upserted AS (
+        INSERT INTO conferences_anonymous_rates (id, user_id, session_id, rate) VALUES ($3, $1, $2, $4)
+        ON CONFLICT (user_id, session_id) DO UPDATE SET rate = EXCLUDED.rate
+    )
+    UPDATE conferences_session_rates SET
+        nr_votes = nr_votes + (CASE WHEN p.rate IS NULL THEN 1 ELSE 0 END),
+        total_rates = total_rates + $4 - COALESCE(p.rate, 0),
+        nr_rates_1 = nr_rates_1 + (CASE WHEN $4 = 1 THEN 1 ELSE 0 END) - (CASE WHEN p.rate = 1 THEN 1 ELSE 0 END),
+        nr_rates_2 = nr_rates_2 + (CASE WHEN $4 = 2 THEN 1 ELSE 0 END) - (CASE WHEN p.rate = 2 THEN 1 ELSE 0 END),
+        nr_rates_3 = nr_rates_3 + (CASE WHEN $4 = 3 THEN 1 ELSE 0 END) - (CASE WHEN p.rate = 3 THEN 1 ELSE 0 END),
+        nr_rates_4 = nr_rates_4 + (CASE WHEN $4 = 4 THEN 1 ELSE 0 END) - (CASE WHEN p.rate = 4 THEN 1 ELSE 0 END),
+        nr_rates_5 = nr_rates_5 + (CASE WHEN $4 = 5 THEN 1 ELSE 0 END) - (CASE WHEN p.rate = 5 THEN 1 ELSE 0 END)
+    FROM (SELECT (SELECT rate FROM previous) AS rate) AS p
+    WHERE session_id = $2
+    RETURNING nr_votes, total_rates
+    """
+
+# creates the aggregate row if missing and locks it, so ratings of the same session
+# (and double taps of the same user) are applied one after another
+LOCK_SESSION_RATES_SQL = \
+    """
+    INSERT INTO conferences_session_rates (id, session_id) VALUES ($1, $2)
+    ON CONFLICT (session_id) DO UPDATE SET nr_votes = conferences_session_rates.nr_votes
+    """
+
+
+async def rate_session(id_user, id_session, rate):
+    if rate < 1 or rate > 5:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail={"code": "RATE_NOT_VALID", "message": "rate not valid, use number between 1 and 5"})
+
+    rateable, start_date = await get_session_meta(id_session)
+
+    if not rateable:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
                             detail={"code": "SESSION_IS_NOT_RATEABLE", "message": "session is not rateable"})
 
-    session_start_datetime_str = f'{session.start_date}'
+    session_start_datetime_str = f'{start_date}'
 
     if str(now()) < session_start_datetime_str:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
@@ -840,104 +1020,209 @@ async def rate_session(id_user, id_session, rate):
                                     "message": "Rating is only possible after the talk has started."})
 
     try:
-        current_rate = await models.AnonymousRate.filter(user=user, session=session).get_or_none()
-    except Exception as e:
-        raise
-
-    if not current_rate:
-        await models.AnonymousRate.create(user=user, session=session, rate=rate)
-    else:
-        if current_rate.rate != rate:
-            await current_rate.update_from_dict({'rate': rate})
-            await current_rate.save()
-
-    all_rates = await models.AnonymousRate.filter(session=session).all()
-    avg_rate = sum([rate.rate for rate in all_rates]) / len(all_rates) if all_rates else 0
-
-    return {'avg_rate': avg_rate,
-            'total_rates': len(all_rates),
+        async with in_transaction() as connection:
+            await connection.execute_query(LOCK_SESSION_RATES_SQL, [uuid.uuid4(), str(id_session)])
+            _, rows = await connection.execute_query(RATE_SESSION_SQL,
+                                                     [str(id_user), str(id_session), uuid.uuid4(), rate])
+    except tortoise.exceptions.IntegrityError as e:
+        raise not_found_for_integrity_error(e, id_user)
+
+    await bump_user_state_version(id_user, ratings_changed=True)
+
+    nr_votes, total_rates = rows[0]['nr_votes'], rows[0]['total_rates']
+    return {'avg_rate': total_rates / nr_votes,
+            'total_rates': nr_votes,
             }
 
 
-async def opencon_serialize_anonymouse(user_id, conference, last_updated=None):
-    next_try_in_ms = 3000000
-    db_last_updated = str(tortoise.timezone.make_naive(conference.last_updated))
+async def sync_user_state(id_user, bookmarks: dict = None, ratings: dict = None):
+    """
+    Applies desired bookmark states ({id_session: bool}) and ratings ({id_session: rate}) collected
+    by offline client in one transaction, and returns resulting state of the user.
+    """
 
-    conference_avg_rating = {'rates_by_session': {},
-                             'my_rate_by_session': {}
-                             }
-    for session in conference.event_sessions:
-        if session.anonymous_rates:
-            all_rates_for_session = [r.rate for r in session.anonymous_rates]
-            if all_rates_for_session:
-                conference_avg_rating['rates_by_session'][str(session.id)] = [
-                    sum(all_rates_for_session) / len(all_rates_for_session),
-                    len(all_rates_for_session)]  # [session.anonymous_rates.avg_stars,
-            # session.anonymous_rates.nr_votes]
+    bookmarks = {str(k): v for k, v in (bookmarks or {}).items()}
+    ratings = {str(k): v for k, v in (ratings or {}).items()}
 
-    user = await models.UserAnonymous.filter(id=user_id).prefetch_related('bookmarks', 'rates').get_or_none()
+    for rate in ratings.values():
+        if rate < 1 or rate > 5:
+            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                detail={"code": "RATE_NOT_VALID", "message": "rate not valid, use number between 1 and 5"})
 
-    bookmarks = [bookmark.session_id for bookmark in user.bookmarks]
-    conference_avg_rating['my_rate_by_session'] = {str(rate.session_id): rate.rate for rate in user.rates}
+    id_sessions = set(bookmarks.keys()) | set(ratings.keys())
+    sessions = {str(s['id']): s for s in
+                await models.EventSession.filter(id__in=id_sessions).values('id', 'rateable', 'start_date')}
 
-    if last_updated and last_updated >= db_last_updated:
-        return {'last_updated': db_last_updated,
-                'ratings': conference_avg_rating,
-                'bookmarks': bookmarks,
-                'next_try_in_ms': next_try_in_ms,
-                'conference': None
-                }
+    if len(sessions) != len(id_sessions):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"code": "SESSION_NOT_FOUND", "message": "session not found"})
 
-    db = {}
-    idx = {}
+    for id_session in ratings:
+        if not sessions[id_session]['rateable']:
+            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                detail={"code": "SESSION_IS_NOT_RATEABLE", "message": "session is not rateable"})
 
-    with open(current_file_dir + '/../../tests/assets/sfs2023streaming.yaml', 'r') as f:
-        streaming_links = yaml.load(f, yaml.Loader)
+        if str(now()) < f'{sessions[id_session]["start_date"]}':
+            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                detail={"code": "CAN_NOT_RATE_SESSION_IN_FUTURE",
+                                        "message": "Rating is only possible after the talk has started."})
+
+    set_bookmarks = [id_session for id_session, bookmarked in bookmarks.items() if bookmarked]
+    unset_bookmarks = [id_session for id_session, bookmarked in bookmarks.items() if not bookmarked]
+
+    async with in_transaction() as connection:
+        if set_bookmarks:
+            await models.AnonymousBookmark.bulk_create(
+                [models.AnonymousBookmark(user_id=id_user, session_id=id_session) for id_session in set_bookmarks],
+                ignore_conflicts=True, using_db=connection)
+
+        if unset_bookmarks:
+            await models.AnonymousBookmark.filter(user_id=id_user, session_id__in=unset_bookmarks).using_db(
+                connection).delete()
+
+        if ratings:
+            await models.SessionRates.bulk_create(
+                [models.SessionRates(session_id=id_session) for id_session in ratings],
+                ignore_conflicts=True, using_db=connection)
+
+            # locked in the same order as in every other sync, to avoid deadlocks between concurrent syncs
+            aggregates = {str(a.session_id): a for a in
+                          await models.SessionRates.filter(session_id__in=list(ratings.keys())).order_by(
+                              'session_id').select_for_update().using_db(connection)}
+
+            current_rates = {str(r.session_id): r for r in
+                             await models.AnonymousRate.filter(user_id=id_user,
+                                                               session_id__in=list(ratings.keys())).using_db(connection)}
+
+            new_rates, changed_rates = [], []
+            for id_session, rate in ratings.items():
+                current_rate = current_rates.get(id_session)
+                if not current_rate:
+                    new_rates.append(models.AnonymousRate(user_id=id_user, session_id=id_session, rate=rate))
+                    aggregates[id_session].add_rate(rate)
+                elif current_rate.rate != rate:
+                    aggregates[id_session].add_rate(rate, previous_rate=current_rate.rate)
+                    current_rate.rate = rate
+                    changed_rates.append(current_rate)
+
+            if new_rates:
+                await models.AnonymousRate.bulk_create(new_rates, using_db=connection)
+            if changed_rates:
+                await models.AnonymousRate.bulk_update(changed_rates, fields=['rate'], using_db=connection)
+            if new_rates or changed_rates:
+                await models.SessionRates.bulk_update(list(aggregates.values()),
+                                                      fields=['nr_votes', 'total_rates', 'nr_rates_1', 'nr_rates_2',
+                                                              'nr_rates_3', 'nr_rates_4', 'nr_rates_5'],
+                                                      using_db=connection)
+
+    await bump_user_state_version(id_user, ratings_changed=bool(ratings))
+
+    return await get_user_state(id_user, await get_current_conference_header())
+
+
+def build_conference_index(db):
+    """
+    Builds all 'idx' structures of the conference document in a single pass over sessions,
+    returns idx and lecturers ordered by display name
+    """
+
+    sessions_by_day = {}
+    sessions_by_track = {id_track: [] for id_track in db['tracks']}
+
+    for session in db['sessions'].values():
+        sessions_by_day.setdefault(session['date'], []).append(session['id'])
+
+        track_sessions = sessions_by_track.get(session['id_track'])
+        if track_sessions is not None:
+            track_sessions.append(session['id'])
+
+    days = sorted(sessions_by_day)
+    ordered_lecturers = sorted(db['lecturers'].values(), key=lambda x: x['display_name'])
+
+    idx = {'ordered_sponsors': [],
+           'ordered_lecturers_by_display_name': [l['id'] for l in ordered_lecturers],
+           'ordered_sessions_by_days': {d: sessions_by_day[d] for d in days},
+           'ordered_sessions_by_tracks': sessions_by_track,
+           'days': days,
+           }
+
+    return idx, {l['id']: l for l in ordered_lecturers}
+
+
+def serialize_conference_document(conference):
+    db = {}
 
-    idx['ordered_sponsors'] = []
+    streaming_links = side_assets.get('streaming_links')
 
     db['tracks'] = {str(track.id): track.serialize() for track in conference.tracks}
     db['locations'] = {str(location.id): location.serialize() for location in conference.locations}
     db['rooms'] = {str(room.id): room.serialize() for room in conference.rooms}
     db['sessions'] = {str(session.id): session.serialize(streaming_links) for session in conference.event_sessions}
     db['lecturers'] = {str(lecturer.id): lecturer.serialize() for lecturer in conference.lecturers}
-    db['sponsors'] = {}
+    db['sponsors'] = side_assets.get('sponsors')
+
+    idx, db['lecturers'] = build_conference_index(db)
+
+    return {'acronym': str(conference.acronym),
+            'db': db,
+            'idx': idx
+            }
+
 
-    days = set()
-    for s in db['sessions'].values():
-        days.add(s['date'])
+async def get_rates_by_session(conference):
+    rates = await models.SessionRates.filter(session__conference_id=conference.id, nr_votes__gt=0).values(
+        'session_id', 'nr_votes', 'total_rates')
+
+    return {str(r['session_id']): [r['total_rates'] / r['nr_votes'], r['nr_votes']] for r in rates}
+
+
+async def get_user_bookmarks_and_rates(user_id):
+    user = await models.UserAnonymous.filter(id=user_id).prefetch_related('bookmarks', 'rates').get_or_none()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"code": "USER_NOT_FOUND", "message": "user not found"})
+
+    bookmarks = [bookmark.session_id for bookmark in user.bookmarks]
+    my_rate_by_session = {str(rate.session_id): rate.rate for rate in user.rates}
 
-    idx['ordered_lecturers_by_display_name'] = [l['id'] for l in
-                                                sorted(db['lecturers'].values(), key=lambda x: x['display_name'])]
-    idx['ordered_sessions_by_days'] = {d: [s['id'] for s in db['sessions'].values() if s['date'] == d] for d in
-                                       sorted(list(days))}
-    idx['ordered_sessions_by_tracks'] = {t: [s['id'] for s in db['sessions'].values() if s['id_track'] == t] for t in
-                                         db['tracks'].keys()}
-    idx['days'] = sorted(list(days))
+    return bookmarks, my_rate_by_session
 
-    # conference_avg_rating = {'rates_by_session': {}}
-    # for session in conference.event_sessions:
-    #     if session.starred_session and session.starred_session.nr_votes:
-    #         conference_avg_rating['rates_by_session'][str(session.id)] = [session.starred_session.avg_stars,
-    #                                                                       session.starred_session.nr_votes]
 
-    with open(current_file_dir + '/../../tests/assets/sfscon2024sponsors.yaml', 'r') as f:
-        db['sponsors'] = yaml.load(f, yaml.Loader)
+async def get_user_state(user_id, conference):
+    bookmarks, my_rate_by_session = await get_user_bookmarks_and_rates(user_id)
+    rates_by_session = await get_rates_by_session(conference)
 
-    re_ordered_lecturers = {}
-    for l in idx['ordered_lecturers_by_display_name']:
-        re_ordered_lecturers[l] = db['lecturers'][l]
+    return {'bookmarks': bookmarks,
+            'my_rate_by_session': my_rate_by_session,
+            'ratings_digest': utils.calculate_md5_checksum_for_dict(rates_by_session)
+            }
+
+
+async def opencon_serialize_anonymouse(user_id, conference, last_updated=None):
+    next_try_in_ms = 3000000
+    db_last_updated = str(tortoise.timezone.make_naive(conference.last_updated))
+
+    bookmarks, my_rate_by_session = await get_user_bookmarks_and_rates(user_id)
+
+    conference_avg_rating = {'rates_by_session': await get_rates_by_session(conference),
+                             'my_rate_by_session': my_rate_by_session
+                             }
+
+    if last_updated and last_updated >= db_last_updated:
+        return {'last_updated': db_last_updated,
+                'ratings': conference_avg_rating,
+                'bookmarks': bookmarks,
+                'next_try_in_ms': next_try_in_ms,
+                'conference': None
+                }
 
-    db['lecturers'] = re_ordered_lecturers
+    snapshot = await get_conference_snapshot(conference)
 
-    return {'last_updated': db_last_updated,
+    return {'last_updated': snapshot.db_last_updated,
             'ratings': conference_avg_rating,
             'next_try_in_ms': next_try_in_ms,
             'bookmarks': bookmarks,
-            'conference': {'acronym': str(conference.acronym),
-                           'db': db,
-                           'idx': idx
-                           }
+            'conference': snapshot.document
             }
 
 # REMOVE
@@ -0,0 +1,180 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import os
+import time
+import uuid
+import redis
+import asyncio
+import logging
+import redis.asyncio
+
+from fastapi import HTTPException, status
+
+from .conference import import_conference_xml
+
+log = logging.getLogger('conference_logger')
+
+IMPORT_LOCK_KEY = 'opencon_import_lock'
+# lock expires if importer dies, while import is running it is extended every IMPORT_LOCK_TTL / 3 seconds
+IMPORT_LOCK_TTL = float(os.getenv('IMPORT_LOCK_TTL', 60))
+# socket timeout of lock commands, unreachable Redis must not block the event loop nor the import for long
+IMPORT_LOCK_REDIS_TIMEOUT = float(os.getenv('IMPORT_LOCK_REDIS_TIMEOUT', 5))
+
+_lock_redis = None
+
+
+def get_lock_redis():
+    global _lock_redis
+
+    if _lock_redis is None:
+        _lock_redis = redis.asyncio.Redis(host=os.getenv('REDIS_SERVER'),
+                                          socket_timeout=IMPORT_LOCK_REDIS_TIMEOUT,
+                                          socket_connect_timeout=IMPORT_LOCK_REDIS_TIMEOUT)
+    return _lock_redis
+
+
+class RedisLock:
+    """
+    Lock held in Redis (SET NX PX) by a random token, only the owner can extend or release it.
+    """
+
+    def __init__(self, redis_client: redis.asyncio.Redis, key: str, ttl: float):
+        self.redis = redis_client
+        self.key = key
+        self.ttl_ms = int(ttl * 1000)
+        self.token = uuid.uuid4().hex.encode('utf-8')
+        self.lost = False
+
+    async def acquire(self):
+        return bool(await self.redis.set(self.key, self.token, nx=True, px=self.ttl_ms))
+
+    async def extend(self):
+        return await self.if_owner(lambda pipe: pipe.pexpire(self.key, self.ttl_ms))
+
+    async def release(self):
+        return await self.if_owner(lambda pipe: pipe.delete(self.key))
+
+    async def if_owner(self, command):
+        async with self.redis.pipeline() as pipe:
+            try:
+                await pipe.watch(self.key)
+                if await pipe.get(self.key) != self.token:
+                    await pipe.unwatch()
+                    return False
+
+                pipe.multi()
+                command(pipe)
+                await pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+
+async def acquire_import_lock():
+    """
+    Acquires import lock, import running in other process is reported as conflict right away,
+    as the trigger would otherwise wait for it and then import the same schedule again.
+    Without Redis import is not started, only one import may run cluster-wide.
+    """
+
+    lock = RedisLock(get_lock_redis(), IMPORT_LOCK_KEY, IMPORT_LOCK_TTL)
+
+    try:
+        acquired = await lock.acquire()
+    except redis.exceptions.RedisError as e:
+        log.critical(f'Redis not available, import is not started :: {str(e)}')
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail={"code": "IMPORT_LOCK_NOT_AVAILABLE",
+                                    "message": "Import lock is not available, import is not started"})
+
+    if not acquired:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail={"code": "IMPORT_IN_PROGRESS",
+                                    "message": "Import is already running on other instance"})
+
+    return lock
+
+
+async def keep_import_lock(lock: RedisLock, import_task: asyncio.Future):
+    # import is cancelled (and its transaction rolled back) as soon as the lock
+    # is lost, or would expire before the next try to extend it
+    interval = IMPORT_LOCK_TTL / 3
+    extended_at = time.monotonic()
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await lock.extend():
+                log.critical('Import lock lost while import is running, import is cancelled')
+                break
+            extended_at = time.monotonic()
+        except redis.exceptions.RedisError as e:
+            log.critical(f'Error extending import lock :: {str(e)}')
+            if time.monotonic() - extended_at + interval >= IMPORT_LOCK_TTL:
+                log.critical('Import lock expires, import is cancelled')
+                break
+
+    lock.lost = True
+    import_task.cancel()
+
+
+class ImportRunner:
+    """
+    Single-flight import: one import at a time in this process (and, through the Redis lock,
+    cluster-wide). Trigger with the same parameters as the import in flight does not start
+    another one, it waits for the running import and gets its result. Forced trigger does not
+    join not forced import, which may end as not modified, it runs after it.
+    """
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.in_flight = {}
+
+    async def run(self, **params):
+        key = tuple(sorted(params.items()))
+
+        task = self.in_flight.get(key)
+        if task:
+            log.info(f'Import {params} is already running, waiting for its result')
+        else:
+            task = asyncio.ensure_future(self.run_locked(params))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self.in_flight.pop(key, None) if self.in_flight.get(key) is t else None)
+
+        # waiting trigger may be cancelled (client disconnected), import itself continues
+        return await asyncio.shield(task)
+
+    async def run_locked(self, params):
+        async with self.lock:
+            lock = await acquire_import_lock()
+            import_task = asyncio.ensure_future(import_conference_xml(**params))
+            keeper = asyncio.ensure_future(keep_import_lock(lock, import_task))
+            try:
+                return await import_task
+            except asyncio.CancelledError:
+                if not lock.lost:
+                    raise
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail={"code": "IMPORT_LOCK_LOST",
+                                            "message": "Import lock was lost, import is cancelled"})
+            finally:
+                keeper.cancel()
+                import_task.cancel()
+                if not lock.lost:
+                    try:
+                        await lock.release()
+                    except redis.exceptions.RedisError as e:
+                        log.critical(f'Error releasing import lock :: {str(e)}')
+
+
+import_runner = ImportRunner()
+
+
+async def run_import(use_local_xml=False, local_xml_fname='sfscon2024.xml', force=True,
+                     group_notifications_by_user=True, allow_deletions=False):
+    return await import_runner.run(use_local_xml=use_local_xml,
+                                   local_xml_fname=local_xml_fname,
+                                   force=force,
+                                   group_notifications_by_user=group_notifications_by_user,
+                                   allow_deletions=allow_deletions)
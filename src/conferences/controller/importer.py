@@ -0,0 +1,630 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+# Schedule import, split in stages:
+#
+#   parse - records of the XML stream to plain records, no database access
+#   load  - existing locations, tracks, rooms, sessions and lecturers of the conference, one query each, in parallel
+#   clean - HTML of bios and descriptions of changed events to text, in worker processes
+#   diff  - records against loaded state, in memory, result is a ChangeSet
+#   apply - bulk inserts / updates / deletes from the ChangeSet, in the import transaction (see add_conference)
+
+import os
+import json
+import asyncio
+import logging
+import datetime
+import multiprocessing
+import concurrent.futures
+import slugify
+import tortoise.timezone
+
+from fastapi import HTTPException, status
+
+import shared.utils as utils
+from shared.text import clean_html, clean_html_batch, clean_bio_batch
+import conferences.models as models
+
+log = logging.getLogger('conference_logger')
+
+# fields of EventSession taken from XML, only these are compared and updated
+SESSION_FIELDS = ('title', 'url', 'abstract', 'description', 'bookmarkable', 'rateable', 'track_id', 'room_id',
+                  'str_start_time', 'start_date', 'duration', 'end_date', 'content_hash')
+
+# part of event content hash, bump it when parsing of events changes,
+# so all sessions are parsed and compared again on the next import
+EVENT_HASH_VERSION = 1
+
+# the same for persons, bump it when parsing of persons or cleaning of bios changes
+PERSON_HASH_VERSION = 1
+
+LECTURER_FIELDS = ('display_name', 'first_name', 'last_name', 'bio', 'organization', 'thumbnail_url', 'slug',
+                   'social_networks', 'content_hash')
+
+# text normalization is CPU bound, it runs in worker processes so the event loop keeps serving
+# requests during import, with 0 workers it runs inline
+IMPORT_TEXT_WORKERS = int(os.getenv('IMPORT_TEXT_WORKERS', 2))
+IMPORT_TEXT_BATCH_SIZE = int(os.getenv('IMPORT_TEXT_BATCH_SIZE', 32))
+
+# sessions missing in the schedule are deleted together with their bookmarks and rates, import which would
+# delete more than this share of existing sessions is refused unless deletions are allowed
+IMPORT_MAX_DELETED_SESSIONS_RATIO = float(os.getenv('IMPORT_MAX_DELETED_SESSIONS_RATIO', 0.5))
+
+_text_pool = None
+
+
+def as_list(value):
+    # xmltodict returns single child element as dict and repeated ones as list
+    if value is None:
+        return []
+    return [value] if isinstance(value, dict) else value
+
+
+def room_start_offset(room_name):
+    # sessions starting at the same time are ordered by room
+    if room_name == 'Seminar 2':
+        return datetime.timedelta(milliseconds=1)
+    if room_name == 'Seminar 3':
+        return datetime.timedelta(milliseconds=2)
+    if room_name == 'Seminar 4':
+        return datetime.timedelta(milliseconds=3)
+    if room_name.startswith('Auditorium'):
+        return datetime.timedelta(milliseconds=4)
+    return datetime.timedelta(0)
+
+
+# location of all rooms
+DEFAULT_LOCATION = {'name': 'Noi Tech Park', 'slug': 'noi'}
+
+# sessions without track in XML are in this one
+DEFAULT_TRACK = {'order': -1, 'name': 'SFSCON', 'slug': 'sfscon', 'color': 'black'}
+
+
+def parse_tracks(content_tracks):
+    order = 0
+
+    cvt = {'#text': 'name', '@color': 'color'}
+
+    for track in content_tracks['track']:
+        order += 1
+        defaults = {'order': order, 'color': 'black'}
+
+        # TODO: Remove this after Luka fix it in XML
+
+        if track == 'Main track - Main track':
+            track = 'Main track'
+
+        if type(track) == str:
+            defaults['name'] = track
+        else:
+            for k, v in track.items():
+                if k in cvt:
+                    defaults[cvt[k]] = v
+
+        defaults['slug'] = slugify.slugify(defaults['name'])
+
+        yield defaults
+
+
+def parse_person(person):
+    display_name = person['#text']
+    social_networks = person.get('@socials', None)
+
+    return {'external_id': person['@id'],
+            'display_name': display_name,
+            'first_name': display_name.split(' ')[0].capitalize(),
+            'last_name': ' '.join(display_name.split(' ')[1:]).capitalize(),
+            'bio': person.get('@bio', None),  # cleaned by clean_texts
+            'organization': person.get('@organization', None),
+            'thumbnail_url': person.get('@thumbnail', None),
+            'slug': slugify.slugify(display_name),
+            'social_networks': json.loads(social_networks) if social_networks else [],
+            'content_hash': utils.calculate_md5_checksum_for_dict({'version': PERSON_HASH_VERSION,
+                                                                   'person': person}),
+            }
+
+
+def event_track_name(event):
+    track_name = event.get('track', None)
+    if type(track_name) == dict:
+        track_name = track_name['#text']
+
+    # TODO: Remove this after Luka fix it in XML
+
+    if track_name in ('SFSCON - Main track', 'Main track - Main track'):
+        track_name = 'SFSCON'  # 'Main track'
+
+    return track_name
+
+
+def event_content_hash(date, room_name, event):
+    return utils.calculate_md5_checksum_for_dict({'version': EVENT_HASH_VERSION,
+                                                  'date': date,
+                                                  'room': room_name,
+                                                  'event': event})
+
+
+def parse_event(record):
+    # values of session fields, parsed only for events which changed since the last import
+    event = record['event']
+    date = record['date']
+
+    event_start = event.get('start', None)
+    if not event_start or len(event_start) != 5:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail={"code": "EVENT_START_NOT_VALID",
+                                    "message": f"Start time of event {record['unique_id']} is not valid"})
+
+    start_date = datetime.datetime(year=int(date[0:4]),
+                                   month=int(date[5:7]),
+                                   day=int(date[8:10]),
+                                   hour=int(event_start[0:2]),
+                                   minute=int(event_start[3:5])) + room_start_offset(record['room_name'])
+
+    duration = event.get('duration', None)
+    if duration and len(duration) == 5:
+        duration = int(duration[0:2]) * 60 * 60 + int(duration[3:5]) * 60
+    else:
+        duration = None
+
+    # description is cleaned ahead by clean_texts, except when only track or room of the event changed
+    description = record['description'] if 'description' in record else clean_html(event.get('description', None))
+
+    return {'title': event['title'],
+            'url': event.get('url', None),
+            'abstract': event.get('abstract', None),
+            'description': description,
+            'bookmarkable': event.get('@bookmark', "0") == "1",
+            'rateable': event.get('@rating', "0") == "1",
+            'str_start_time': start_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'start_date': start_date,
+            'duration': duration,
+            'end_date': start_date + datetime.timedelta(seconds=duration) if duration else None,
+            }
+
+
+class ScheduleParser:
+    """
+    Collects records produced by ScheduleXmlStream (see schedule_xml.py) into
+    records of rooms, events and lecturers. Events are kept as they are in XML
+    together with their content hash, see parse_event.
+    """
+
+    def __init__(self):
+        self.conference = None
+        self.tracks = None
+
+        self.rooms = {}
+        self.events = {}
+        self.persons = {}
+
+    def add(self, record):
+        if record[0] in ('conference', 'tracks'):
+            setattr(self, record[0], record[1])
+        elif record[0] == 'room':
+            self.add_room(record[2])
+        elif record[0] == 'event':
+            self.add_event(*record[1:])
+
+    def add_room(self, room_name):
+        room_slug = slugify.slugify(room_name)
+        return room_slug, self.rooms.setdefault(room_slug, room_name)
+
+    def add_event(self, date, room_name, event):
+        if type(event) != dict:
+            return
+
+        # events without unique id are ignored, for duplicated ones the first occurrence is used
+        unique_id = event.get('@unique_id', None)
+        if not unique_id or unique_id in self.events:
+            return
+
+        room_slug, room_name = self.add_room(room_name)
+
+        external_ids = []
+        for person in as_list((event.get('persons', None) or {}).get('person', None)):
+            if not person.get('@id', None):
+                continue
+
+            # person appears once per event, the last occurrence in the document wins
+            self.persons[person['@id']] = person
+            external_ids.append(person['@id'])
+
+        self.events[unique_id] = {'unique_id': unique_id,
+                                  'content_hash': event_content_hash(date, room_name, event),
+                                  'date': date,
+                                  'room_name': room_name,
+                                  'room_slug': room_slug,
+                                  'track_name': event_track_name(event),
+                                  'lecturers': list(dict.fromkeys(external_ids)),
+                                  'event': event,
+                                  }
+
+    def schedule(self):
+        return {'tracks': list(parse_tracks(self.tracks)) if self.tracks else [],
+                'rooms': self.rooms,
+                'events': self.events,
+                'lecturers': {external_id: parse_person(person) for external_id, person in self.persons.items()},
+                }
+
+
+class ExistingSchedule:
+
+    def __init__(self, locations: dict, tracks: dict, rooms: dict, sessions: dict, lecturers: dict,
+                 session_lecturers: set):
+        self.locations = locations
+        self.tracks = tracks
+        self.rooms = rooms
+        self.sessions = sessions
+        self.lecturers = lecturers
+        self.session_lecturers = session_lecturers
+
+
+async def load_existing_schedule(conference: models.Conference, created: bool):
+    if created:
+        # conference which is not imported yet has nothing to load
+        return ExistingSchedule(locations={}, tracks={}, rooms={}, sessions={}, lecturers={}, session_lecturers=set())
+
+    locations, tracks, rooms, sessions, lecturers, session_lecturers = await asyncio.gather(
+        models.Location.filter(conference=conference),
+        models.Track.filter(conference=conference),
+        models.Room.filter(conference=conference),
+        models.EventSession.filter(conference=conference),
+        models.ConferenceLecturer.filter(conference=conference),
+        models.ConferenceLecturer.filter(conference=conference,
+                                         event_sessions__id__isnull=False).values_list('id', 'event_sessions__id'))
+
+    return ExistingSchedule(locations={location.slug: location for location in locations},
+                            tracks={track.name: track for track in tracks},
+                            rooms={(room.location_id, room.slug): room for room in rooms},
+                            sessions={session.unique_id: session for session in sessions},
+                            lecturers={lecturer.external_id: lecturer for lecturer in lecturers},
+                            session_lecturers=set(session_lecturers))
+
+
+def get_text_pool():
+    global _text_pool
+
+    if _text_pool is None:
+        # spawned workers do not inherit event loop and database connections of this process, but each of them
+        # imports __main__ of this process (whole app for API), so pool is started only when there is something
+        # to clean and then kept for the next imports
+        _text_pool = concurrent.futures.ProcessPoolExecutor(max_workers=IMPORT_TEXT_WORKERS,
+                                                            mp_context=multiprocessing.get_context('spawn'))
+    return _text_pool
+
+
+def shutdown_text_pool(wait=True):
+    global _text_pool
+
+    if _text_pool is not None:
+        pool, _text_pool = _text_pool, None
+        pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+async def run_text_batches(fn, texts):
+    if not IMPORT_TEXT_WORKERS:
+        return fn(texts)
+
+    loop = asyncio.get_running_loop()
+    batches = [texts[i:i + IMPORT_TEXT_BATCH_SIZE] for i in range(0, len(texts), IMPORT_TEXT_BATCH_SIZE)]
+
+    try:
+        results = await asyncio.gather(*[loop.run_in_executor(get_text_pool(), fn, batch) for batch in batches])
+    except concurrent.futures.process.BrokenProcessPool as e:
+        # worker died (e.g. killed for memory), pool is unusable, it is started again for the next import
+        # and this one cleans texts inline
+        log.critical(f'Text pool is broken, texts are cleaned inline :: {str(e)}')
+        shutdown_text_pool(wait=False)
+        return fn(texts)
+
+    return [text for result in results for text in result]
+
+
+async def clean_texts(parsed: dict, existing: ExistingSchedule):
+    """
+    Cleans bios of lecturers and descriptions of events changed since the last import,
+    cleaned texts replace the raw ones in parsed records. Unchanged lecturers get the
+    bio stored with the last import.
+    """
+
+    events = [record for unique_id, record in parsed['events'].items()
+              if unique_id not in existing.sessions or
+              existing.sessions[unique_id].content_hash != record['content_hash']]
+
+    lecturers = []
+    for external_id, record in parsed['lecturers'].items():
+        lecturer = existing.lecturers.get(external_id, None)
+        if lecturer and lecturer.content_hash == record['content_hash']:
+            record['bio'] = lecturer.bio
+        else:
+            lecturers.append(record)
+
+    descriptions, bios = await asyncio.gather(
+        run_text_batches(clean_html_batch, [record['event'].get('description', None) for record in events]),
+        run_text_batches(clean_bio_batch, [record['bio'] for record in lecturers]))
+
+    for record, description in zip(events, descriptions):
+        record['description'] = description
+
+    for record, bio in zip(lecturers, bios):
+        record['bio'] = bio
+
+
+class ChangeSet:
+
+    def __init__(self):
+        self.new_locations = []
+        self.new_tracks = []
+        self.new_rooms = []
+
+        self.new_sessions = []
+        self.updated_sessions = []
+        self.updated_session_fields = set()
+        self.deleted_sessions = []
+        self.unchanged_sessions = 0
+        self.existing_sessions = 0
+        self.imported_sessions = 0
+
+        self.new_lecturers = []
+        self.updated_lecturers = []
+        self.updated_lecturer_fields = set()
+        self.deleted_lecturers = []
+
+        # (id_lecturer, id_session) pairs
+        self.new_session_lecturers = []
+        self.deleted_session_lecturers = []
+
+        # {id_session: {'old_start_timestamp': ..., 'new_start_timestamp': ...}}, used for push notifications
+        self.rescheduled = {}
+
+        # {id: [field, ...]} of updated sessions and lecturers
+        self.changed_fields = {}
+
+    def summary(self):
+        return {'new_locations': len(self.new_locations),
+                'new_tracks': len(self.new_tracks),
+                'new_rooms': len(self.new_rooms),
+                'new_sessions': len(self.new_sessions),
+                'updated_sessions': len(self.updated_sessions),
+                'deleted_sessions': len(self.deleted_sessions),
+                'unchanged_sessions': self.unchanged_sessions,
+                'new_lecturers': len(self.new_lecturers),
+                'updated_lecturers': len(self.updated_lecturers),
+                'deleted_lecturers': len(self.deleted_lecturers),
+                'new_session_lecturers': len(self.new_session_lecturers),
+                'deleted_session_lecturers': len(self.deleted_session_lecturers),
+                'rescheduled_sessions': len(self.rescheduled),
+                }
+
+    def report(self):
+        def updated(objs, key):
+            # sessions with only new content hash have the same values
+            report = {getattr(obj, key): [field for field in self.changed_fields[str(obj.id)] if field != 'content_hash']
+                      for obj in objs}
+            return {k: fields for k, fields in report.items() if fields}
+
+        sessions_by_id = {str(session.id): session for session in self.updated_sessions}
+
+        return {'locations': {'new': [location.name for location in self.new_locations]},
+                'tracks': {'new': [track.name for track in self.new_tracks]},
+                'rooms': {'new': [room.name for room in self.new_rooms]},
+                'sessions': {'new': [session.unique_id for session in self.new_sessions],
+                             'updated': updated(self.updated_sessions, 'unique_id'),
+                             'deleted': [session.unique_id for session in self.deleted_sessions],
+                             'rescheduled': {sessions_by_id[id_session].unique_id: {
+                                 'old_start_timestamp': str(change['old_start_timestamp']),
+                                 'new_start_timestamp': str(change['new_start_timestamp'])}
+                                 for id_session, change in self.rescheduled.items()},
+                             },
+                'lecturers': {'new': [lecturer.external_id for lecturer in self.new_lecturers],
+                              'updated': updated(self.updated_lecturers, 'external_id'),
+                              'deleted': [lecturer.external_id for lecturer in self.deleted_lecturers],
+                              },
+                'session_lecturers': {'new': len(self.new_session_lecturers),
+                                      'deleted': len(self.deleted_session_lecturers),
+                                      },
+                }
+
+
+def diff_schedule(conference: models.Conference, parsed: dict, existing: ExistingSchedule):
+    # new objects refer to conference, location and track by id, in dry run these are not saved
+    changes = ChangeSet()
+
+    location = existing.locations.get(DEFAULT_LOCATION['slug'], None)
+    if not location:
+        location = models.Location(conference_id=conference.id, **DEFAULT_LOCATION)
+        changes.new_locations.append(location)
+
+    tracks_by_name = {}
+    for defaults in parsed['tracks'] + [DEFAULT_TRACK]:
+        if defaults['name'] in tracks_by_name:
+            continue
+
+        track = existing.tracks.get(defaults['name'], None)
+        if not track:
+            track = models.Track(conference_id=conference.id, **defaults)
+            changes.new_tracks.append(track)
+
+        tracks_by_name[defaults['name']] = track
+
+    rooms = {room_slug: room for (id_location, room_slug), room in existing.rooms.items() if id_location == location.id}
+    for room_slug, room_name in parsed['rooms'].items():
+        if room_slug not in rooms:
+            rooms[room_slug] = models.Room(conference_id=conference.id, location_id=location.id, name=room_name,
+                                           slug=room_slug)
+            changes.new_rooms.append(rooms[room_slug])
+
+    sessions = {}
+    for unique_id, record in parsed['events'].items():
+        track = tracks_by_name.get(record['track_name'], None) if record['track_name'] else None
+        if not track:
+            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                detail={"code": "EVENT_TRACK_NOT_VALID",
+                                        "message": f"Track of event {unique_id} is not valid"})
+
+        room = rooms[record['room_slug']]
+
+        session = existing.sessions.get(unique_id, None)
+        if session and session.content_hash == record['content_hash'] and \
+                (session.track_id, session.room_id) == (track.id, room.id):
+            # event is the same as in the last import, nothing to parse or compare
+            changes.unchanged_sessions += 1
+            sessions[unique_id] = session
+            continue
+
+        values = parse_event(record)
+        values['content_hash'] = record['content_hash']
+        values['track_id'] = track.id
+        values['room_id'] = room.id
+        values['start_date'] = tortoise.timezone.make_aware(values['start_date'])
+        values['end_date'] = tortoise.timezone.make_aware(values['end_date']) if values['end_date'] else None
+
+        if not session:
+            session = models.EventSession(conference_id=conference.id, unique_id=unique_id, **values)
+            changes.new_sessions.append(session)
+        else:
+            changed_fields = [field for field, value in values.items() if getattr(session, field) != value]
+            if changed_fields:
+                if 'start_date' in changed_fields:
+                    changes.rescheduled[str(session.id)] = {'old_start_timestamp': session.start_date,
+                                                            'new_start_timestamp': values['start_date']}
+
+                for field in changed_fields:
+                    setattr(session, field, values[field])
+
+                changes.updated_sessions.append(session)
+                changes.updated_session_fields.update(changed_fields)
+                changes.changed_fields[str(session.id)] = changed_fields
+
+        sessions[unique_id] = session
+
+    changes.deleted_sessions = [session for unique_id, session in existing.sessions.items()
+                                if unique_id not in parsed['events']]
+    changes.existing_sessions = len(existing.sessions)
+    changes.imported_sessions = len(sessions)
+
+    lecturers = {}
+    for external_id, record in parsed['lecturers'].items():
+        lecturer = existing.lecturers.get(external_id, None)
+        if not lecturer:
+            lecturer = models.ConferenceLecturer(conference_id=conference.id, **record)
+            changes.new_lecturers.append(lecturer)
+        else:
+            changed_fields = [field for field in LECTURER_FIELDS if getattr(lecturer, field) != record[field]]
+            if changed_fields:
+                for field in changed_fields:
+                    setattr(lecturer, field, record[field])
+
+                changes.updated_lecturers.append(lecturer)
+                changes.updated_lecturer_fields.update(changed_fields)
+                changes.changed_fields[str(lecturer.id)] = changed_fields
+
+        lecturers[external_id] = lecturer
+
+    changes.deleted_lecturers = [lecturer for external_id, lecturer in existing.lecturers.items()
+                                 if external_id not in parsed['lecturers']]
+
+    session_lecturers = set()
+    for unique_id, record in parsed['events'].items():
+        for external_id in record['lecturers']:
+            session_lecturers.add((lecturers[external_id].id, sessions[unique_id].id))
+
+    # links of deleted sessions and lecturers are removed by cascade
+    deleted_ids = {s.id for s in changes.deleted_sessions} | {l.id for l in changes.deleted_lecturers}
+
+    changes.new_session_lecturers = sorted(session_lecturers - existing.session_lecturers, key=str)
+    changes.deleted_session_lecturers = sorted([link for link in existing.session_lecturers - session_lecturers
+                                                if link[0] not in deleted_ids and link[1] not in deleted_ids], key=str)
+
+    return changes
+
+
+def deletions_refused(changes: ChangeSet):
+    # empty or mostly missing schedule is rather a broken source than a real change,
+    # returns error detail if the change set should not be applied without allow_deletions
+    if not changes.imported_sessions:
+        return {"code": "SCHEDULE_IS_EMPTY",
+                "message": "Schedule has no events, set allow_deletions to import it"}
+
+    if len(changes.deleted_sessions) > changes.existing_sessions * IMPORT_MAX_DELETED_SESSIONS_RATIO:
+        return {"code": "TOO_MANY_SESSIONS_DELETED",
+                "message": f"Import would delete {len(changes.deleted_sessions)} of {changes.existing_sessions} "
+                           f"sessions, set allow_deletions to import it"}
+
+    return None
+
+
+async def update_fields(model, objects: list, fields: list, connection):
+    """
+    Updates fields of objects with one parameterized statement executed for all of them.
+    Tortoise bulk_update inlines values into SQL, and does not escape JSON ones.
+    """
+
+    meta = model._meta
+    columns = [meta.fields_db_projection[field] for field in fields]
+    assignments = ', '.join(f'"{column}" = ${i + 1}' for i, column in enumerate(columns))
+
+    await connection.execute_many(
+        f'UPDATE "{meta.db_table}" SET {assignments} WHERE "{meta.db_pk_column}" = ${len(columns) + 1}',
+        [[meta.fields_map[field].to_db_value(getattr(obj, field), obj) for field in fields] + [obj.pk]
+         for obj in objects])
+
+
+async def apply_changes(changes: ChangeSet, connection):
+    # runs in transaction of the caller, together with the rest of the import
+    through = models.ConferenceLecturer._meta.fields_map['event_sessions']
+
+    if changes.new_locations:
+        await models.Location.bulk_create(changes.new_locations, using_db=connection)
+
+    if changes.new_tracks:
+        await models.Track.bulk_create(changes.new_tracks, using_db=connection)
+
+    if changes.new_rooms:
+        await models.Room.bulk_create(changes.new_rooms, using_db=connection)
+
+    if changes.deleted_sessions:
+        await models.EventSession.filter(id__in=[s.id for s in changes.deleted_sessions]).using_db(
+            connection).delete()
+
+    if changes.new_sessions:
+        await models.EventSession.bulk_create(changes.new_sessions, using_db=connection)
+
+    if changes.updated_sessions:
+        await update_fields(models.EventSession, changes.updated_sessions, sorted(changes.updated_session_fields),
+                            connection)
+
+    if changes.deleted_lecturers:
+        await models.ConferenceLecturer.filter(id__in=[l.id for l in changes.deleted_lecturers]).using_db(
+            connection).delete()
+
+    if changes.new_lecturers:
+        await models.ConferenceLecturer.bulk_create(changes.new_lecturers, using_db=connection)
+
+    if changes.updated_lecturers:
+        await update_fields(models.ConferenceLecturer, changes.updated_lecturers,
+                            sorted(changes.updated_lecturer_fields), connection)
+
+    # links are inserted and deleted with one statement each, pairs are passed as two parallel arrays
+    if changes.deleted_session_lecturers:
+        await connection.execute_query(
+            f'DELETE FROM "{through.through}" AS t USING unnest($1::uuid[], $2::uuid[]) AS d(id_lecturer, id_session) '
+            f'WHERE t."{through.backward_key}" = d.id_lecturer AND t."{through.forward_key}" = d.id_session',
+            list(map(list, zip(*changes.deleted_session_lecturers))))
+
+    if changes.new_session_lecturers:
+        await connection.execute_query(
+            f'INSERT INTO "{through.through}" ("{through.backward_key}", "{through.forward_key}") '
+            f'SELECT * FROM unnest($1::uuid[], $2::uuid[])',
+            list(map(list, zip(*changes.new_session_lecturers))))
+
+
+async def diff_sessions(conference: models.Conference, content: dict, created: bool):
+    # reads only, result is applied by apply_changes
+    parsed = content['schedule']
+    existing = await load_existing_schedule(conference, created)
+
+    await clean_texts(parsed, existing)
+
+    return diff_schedule(conference, parsed, existing)
@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+# Incremental parser of the schedule XML. Document is fed in chunks as it arrives and
+# records are produced as soon as their element is complete, parsed elements are
+# dropped, so memory does not grow with the size of the document.
+#
+# records:
+#   ('conference', dict)                 <conference> element
+#   ('tracks', dict)                     <tracks> element
+#   ('room', date, room_name)            start of <room> element
+#   ('event', date, room_name, dict)     <event> element
+#
+# Elements are converted to the same structure as xmltodict.parse returns.
+
+import xml.etree.ElementTree as ElementTree
+
+from fastapi import HTTPException, status
+
+from shared.utils import StreamingChecksum
+
+
+def element_to_dict(element):
+    result = {f'@{k}': v for k, v in element.attrib.items()}
+
+    for child in element:
+        value = element_to_dict(child)
+        if child.tag in result:
+            if type(result[child.tag]) != list:
+                result[child.tag] = [result[child.tag]]
+            result[child.tag].append(value)
+        else:
+            result[child.tag] = value
+
+    text = ''.join([element.text or ''] + [child.tail or '' for child in element]).strip() or None
+
+    if not result:
+        return text
+
+    if text is not None:
+        result['#text'] = text
+
+    return result
+
+
+class ScheduleXmlStream:
+
+    def __init__(self):
+        self.parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self.path = []
+        self.date = None
+        self.room_name = None
+
+        # checksum of the raw document, calculated from chunks as they are fed
+        self.md5 = StreamingChecksum()
+
+    @property
+    def checksum(self):
+        return self.md5.hexdigest()
+
+    def feed(self, chunk: bytes):
+        self.parser.feed(self.md5.update(chunk))
+        return self.read_records()
+
+    def close(self):
+        self.parser.close()
+        return self.read_records()
+
+    def read_records(self):
+        records = []
+
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                self.path.append(element.tag)
+                record = self.on_start(element)
+            else:
+                record = self.on_end(element)
+                self.path.pop()
+
+            if record:
+                records.append(record)
+
+        return records
+
+    def on_start(self, element):
+        if self.path == ['schedule', 'day']:
+            self.date = element.get('date', None)
+            if not self.date:
+                raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                    detail={"code": "DAY_DATE_NOT_VALID", "message": "Day date is not valid"})
+
+        elif self.path == ['schedule', 'day', 'room']:
+            self.room_name = element.get('name', None)
+            if not self.room_name:
+                raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                    detail={"code": "ROOM_NAME_NOT_VALID", "message": "Room name is not valid"})
+
+            return 'room', self.date, self.room_name
+
+        return None
+
+    def on_end(self, element):
+        if self.path in (['schedule', 'conference'], ['schedule', 'tracks']):
+            return element.tag, element_to_dict(element)
+
+        if self.path == ['schedule', 'day', 'room', 'event']:
+            record = 'event', self.date, self.room_name, element_to_dict(element)
+            element.clear()
+            return record
+
+        if self.path in (['schedule', 'day', 'room'], ['schedule', 'day']):
+            element.clear()
+
+        return None
@@ -1,8 +1,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
 
-import bs4
-
 from typing import Dict
 from tortoise.models import Model
 from tortoise import fields
@@ -16,6 +14,9 @@ class UserAnonymous(Model):
     created = fields.DatetimeField(auto_now_add=True)
     push_notification_token = fields.CharField(max_length=64, null=True)
 
+    # bumped on every change of user's bookmarks and rates, part of /api/conference etag
+    state_version = fields.IntField(default=0)
+
 class AnonymousBookmark(Model):
     class Meta:
         table = "conferences_anonymous_bookmarks"
@@ -38,6 +39,43 @@ class AnonymousRate(Model):
     rate = fields.IntField()
 
 
+class SessionRates(Model):
+    class Meta:
+        table = "conferences_session_rates"
+
+    id = fields.UUIDField(pk=True)
+    session = fields.OneToOneField('models.EventSession', related_name='rates_aggregate')
+
+    nr_votes = fields.IntField(default=0)
+    total_rates = fields.IntField(default=0)
+
+    nr_rates_1 = fields.IntField(default=0)
+    nr_rates_2 = fields.IntField(default=0)
+    nr_rates_3 = fields.IntField(default=0)
+    nr_rates_4 = fields.IntField(default=0)
+    nr_rates_5 = fields.IntField(default=0)
+
+    @property
+    def avg_rate(self):
+        return self.total_rates / self.nr_votes if self.nr_votes else 0
+
+    def add_rate(self, rate: int, previous_rate: int = None):
+        if previous_rate is None:
+            self.nr_votes += 1
+        else:
+            self.total_rates -= previous_rate
+            setattr(self, f'nr_rates_{previous_rate}', getattr(self, f'nr_rates_{previous_rate}') - 1)
+
+        self.total_rates += rate
+        setattr(self, f'nr_rates_{rate}', getattr(self, f'nr_rates_{rate}') + 1)
+
+    def serialize(self):
+        return {'avg_rate': self.avg_rate,
+                'total_rates': self.nr_votes,
+                'histogram': {str(r): getattr(self, f'nr_rates_{r}') for r in range(1, 6)}
+                }
+
+
 class Conference(Model):
     class Meta:
         table = "conferences"
@@ -55,9 +93,16 @@ class Conference(Model):
     created = fields.DatetimeField(auto_now_add=True)
     last_updated = fields.DatetimeField(auto_now=True)
 
+    # bumped on every rate of any session (by SQL, so last_updated is not changed), part of /api/conference etag
+    ratings_version = fields.IntField(default=0)
+
     source_uri = fields.TextField(null=True)
     source_document_checksum = fields.CharField(max_length=128, null=True)
 
+    # validators of the last imported source document, sent back with conditional requests
+    source_etag = fields.CharField(max_length=255, null=True)
+    source_last_modified = fields.CharField(max_length=64, null=True)
+
     def serialize(self):
         return {
             'id': str(self.id),
@@ -137,6 +182,9 @@ class EventSession(Model):
 
     str_start_time = fields.CharField(max_length=20, null=True)
 
+    # hash of the event in source XML at the last import, session is not compared again while it is the same
+    content_hash = fields.CharField(max_length=32, null=True)
+
     track = fields.ForeignKeyField('models.Track', related_name='event_sessions')
     room = fields.ForeignKeyField('models.Room', related_name='event_sessions')
     conference = fields.ForeignKeyField('models.Conference', related_name='event_sessions')
@@ -185,24 +233,12 @@ class ConferenceLecturer(Model):
     bio = fields.TextField(null=True)
     organization = fields.TextField(null=True)
     social_networks = fields.JSONField(null=True)
-    conference = fields.ForeignKeyField('models.Conference', related_name='lecturers')
-    event_sessions = fields.ManyToManyField('models.EventSession', related_name='lecturers')
-
-    @staticmethod
-    def fix_bio(bio):
-        if not bio:
-            return ''
 
-        bio = bio.replace("\\r\\n", "\n")
-        bio = bio.encode().decode('unicode_escape')  # PRESERVE unicode
+    # hash of the person in source XML at the last import, bio is not cleaned again while it is the same
+    content_hash = fields.CharField(max_length=32, null=True)
 
-        soup = bs4.BeautifulSoup(bio, features="html.parser")
-        bio = soup.get_text()
-        bio = bio.strip('"')
-        bio = bio.replace('\n', '<p>')
-        bio = bio.replace('<\\/p>', '')
-
-        return bio
+    conference = fields.ForeignKeyField('models.Conference', related_name='lecturers')
+    event_sessions = fields.ManyToManyField('models.EventSession', related_name='lecturers')
 
     def serialize(self):
         return {
@@ -0,0 +1,28 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "conferences_session_rates" (
+    "id" UUID NOT NULL  PRIMARY KEY,
+    "nr_votes" INT NOT NULL  DEFAULT 0,
+    "total_rates" INT NOT NULL  DEFAULT 0,
+    "nr_rates_1" INT NOT NULL  DEFAULT 0,
+    "nr_rates_2" INT NOT NULL  DEFAULT 0,
+    "nr_rates_3" INT NOT NULL  DEFAULT 0,
+    "nr_rates_4" INT NOT NULL  DEFAULT 0,
+    "nr_rates_5" INT NOT NULL  DEFAULT 0,
+    "session_id" UUID NOT NULL UNIQUE REFERENCES "conferences_event_sessions" ("id") ON DELETE CASCADE
+);
+        INSERT INTO "conferences_session_rates" ("id", "session_id", "nr_votes", "total_rates",
+                                                 "nr_rates_1", "nr_rates_2", "nr_rates_3", "nr_rates_4", "nr_rates_5")
+        SELECT gen_random_uuid(), "session_id", COUNT(*), SUM("rate"),
+               COUNT(*) FILTER (WHERE "rate" = 1), COUNT(*) FILTER (WHERE "rate" = 2),
+               COUNT(*) FILTER (WHERE "rate" = 3), COUNT(*) FILTER (WHERE "rate" = 4),
+               COUNT(*) FILTER (WHERE "rate" = 5)
+        FROM "conferences_anonymous_rates" GROUP BY "session_id";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "conferences_session_rates";"""
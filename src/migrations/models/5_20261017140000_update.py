@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "conferences" ADD "source_etag" VARCHAR(255);
+        ALTER TABLE "conferences" ADD "source_last_modified" VARCHAR(64);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "conferences" DROP COLUMN "source_etag";
+        ALTER TABLE "conferences" DROP COLUMN "source_last_modified";"""
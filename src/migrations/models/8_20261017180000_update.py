@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "conferences_users_anonymous" ADD "state_version" INT NOT NULL DEFAULT 0;
+        ALTER TABLE "conferences" ADD "ratings_version" INT NOT NULL DEFAULT 0;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "conferences_users_anonymous" DROP COLUMN "state_version";
+        ALTER TABLE "conferences" DROP COLUMN "ratings_version";"""
@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+# Compares index construction of the conference document (idx part of /api/conference)
+# against the previous nested implementation on synthetic conferences.
+#
+# usage (from src folder): python scripts/bench_conference_index.py
+
+import os
+import sys
+import uuid
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conferences.controller.conference import build_conference_index
+
+
+def legacy_build_conference_index(db):
+    idx = {'ordered_sponsors': []}
+
+    days = set()
+    for s in db['sessions'].values():
+        days.add(s['date'])
+
+    idx['ordered_lecturers_by_display_name'] = [l['id'] for l in
+                                                sorted(db['lecturers'].values(), key=lambda x: x['display_name'])]
+    idx['ordered_sessions_by_days'] = {d: [s['id'] for s in db['sessions'].values() if s['date'] == d] for d in
+                                       sorted(list(days))}
+    idx['ordered_sessions_by_tracks'] = {t: [s['id'] for s in db['sessions'].values() if s['id_track'] == t] for t in
+                                         db['tracks'].keys()}
+    idx['days'] = sorted(list(days))
+
+    re_ordered_lecturers = {}
+    for l in idx['ordered_lecturers_by_display_name']:
+        re_ordered_lecturers[l] = db['lecturers'][l]
+
+    return idx, re_ordered_lecturers
+
+
+def synthetic_db(nr_sessions, sessions_per_track=25, sessions_per_day=400, lecturers_per_session=1.5):
+    rnd = random.Random(nr_sessions)
+
+    tracks = {str(uuid.UUID(int=rnd.getrandbits(128))): {'name': f'Track {i}', 'color': 'black'}
+              for i in range(max(1, nr_sessions // sessions_per_track))}
+    id_tracks = list(tracks.keys())
+
+    nr_days = max(1, nr_sessions // sessions_per_day)
+
+    sessions = {}
+    for i in range(nr_sessions):
+        id_session = str(uuid.UUID(int=rnd.getrandbits(128)))
+        sessions[id_session] = {'id': id_session,
+                                'date': f'2024-11-{1 + i * nr_days // nr_sessions:02}',
+                                'id_track': rnd.choice(id_tracks)}
+
+    lecturers = {}
+    for i in range(int(nr_sessions * lecturers_per_session)):
+        id_lecturer = str(uuid.UUID(int=rnd.getrandbits(128)))
+        lecturers[id_lecturer] = {'id': id_lecturer, 'display_name': f'Lecturer {rnd.getrandbits(32):08x}'}
+
+    return {'tracks': tracks, 'sessions': sessions, 'lecturers': lecturers}
+
+
+def main():
+    print(f'{"sessions":>10} {"tracks":>8} {"days":>6} {"legacy ms":>12} {"single pass ms":>16} {"speedup":>9}')
+
+    for nr_sessions in (500, 1000, 2500, 5000):
+        db = synthetic_db(nr_sessions)
+
+        assert legacy_build_conference_index(db) == build_conference_index(db)
+
+        number = 5
+        legacy = min(timeit.repeat(lambda: legacy_build_conference_index(db), number=number, repeat=3)) / number
+        single_pass = min(timeit.repeat(lambda: build_conference_index(db), number=number, repeat=3)) / number
+
+        nr_days = len(set(s['date'] for s in db['sessions'].values()))
+        print(f'{nr_sessions:>10} {len(db["tracks"]):>8} {nr_days:>6} '
+              f'{legacy * 1000:>12.2f} {single_pass * 1000:>16.2f} {legacy / single_pass:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+# Compares text normalization of shared/text.py against the previous implementation
+# (remove_html and ConferenceLecturer.fix_bio) on descriptions and bios from the schedule XML,
+# results of both are checked to be the same.
+#
+# usage (from src folder): python scripts/bench_text.py [tests/assets/sfscon2024.xml]
+
+import os
+import re
+import sys
+import timeit
+import warnings
+
+import bs4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.text import clean_html, clean_bio
+from conferences.controller.schedule_xml import ScheduleXmlStream
+
+
+def legacy_remove_html(text):
+    if not text:
+        return None
+
+    for t in ('<br>', '<br/>', '<br />', '<p>', '</p>'):
+        text = text.replace(t, '\n')
+
+    for t in ('<b>', '<B>'):
+        if t in text:
+            text = text.replace(t, '|Text style={styles.bold}|')
+
+    for t in ('<em>', '<EM>'):
+        if t in text:
+            text = text.replace(t, '|Text style={styles.italic}|')
+
+    for t in ('</b>', '</B>', '</em>', '</EM>'):
+        if t in text:
+            text = text.replace(t, '|/Text|')
+
+    pattern = re.compile('<.*?>')
+    clean_text = re.sub(pattern, '', text)
+
+    clean_text = clean_text.replace('|Text style={styles.bold}|', '<Text style={styles.bold}>')
+    clean_text = clean_text.replace('|Text style={styles.italic}|', '<Text style={styles.italic}>')
+    clean_text = clean_text.replace('|/Text|', '</Text>')
+    clean_text = ' '.join(clean_text.split())
+
+    return clean_text
+
+
+def legacy_fix_bio(bio):
+    if not bio:
+        return ''
+
+    bio = bio.replace("\\r\\n", "\n")
+    bio = bio.encode().decode('unicode_escape')
+
+    soup = bs4.BeautifulSoup(bio, features="html.parser")
+    bio = soup.get_text()
+    bio = bio.strip('"')
+    bio = bio.replace('\n', '<p>')
+    bio = bio.replace('<\\/p>', '')
+
+    return bio
+
+
+def legacy_clean_bio(bio):
+    return legacy_remove_html(legacy_fix_bio(bio))
+
+
+def read_texts(fname):
+    stream = ScheduleXmlStream()
+    with open(fname, 'rb') as f:
+        records = stream.feed(f.read()) + stream.close()
+
+    descriptions, bios = [], {}
+    for record in records:
+        if record[0] != 'event':
+            continue
+
+        event = record[3]
+        descriptions.append(event.get('description', None))
+
+        persons = (event.get('persons', None) or {}).get('person', None) or []
+        for person in [persons] if isinstance(persons, dict) else persons:
+            bios[person.get('@id', None)] = person.get('@bio', None)
+
+    return descriptions, list(bios.values())
+
+
+def bench(name, fn, texts, number=20):
+    t = timeit.timeit(lambda: [fn(text) for text in texts], number=number)
+    print(f'{name:30} {t / number * 1000:8.2f}ms per document')
+    return t
+
+
+if __name__ == '__main__':
+    warnings.simplefilter('ignore')
+
+    fname = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))) + '/tests/assets/sfscon2024.xml'
+
+    descriptions, bios = read_texts(fname)
+    print(f'{fname}: {len(descriptions)} descriptions, {len(bios)} bios')
+
+    assert [clean_html(t) for t in descriptions] == [legacy_remove_html(t) for t in descriptions]
+    assert [clean_bio(t) for t in bios] == [legacy_clean_bio(t) for t in bios]
+
+    legacy = bench('legacy remove_html', legacy_remove_html, descriptions)
+    current = bench('clean_html', clean_html, descriptions)
+    print(f'{"":30} {legacy / current:8.1f}x')
+
+    legacy = bench('legacy remove_html(fix_bio)', legacy_clean_bio, bios)
+    current = bench('clean_bio', clean_bio, bios)
+    print(f'{"":30} {legacy / current:8.1f}x')
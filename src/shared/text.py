@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+# Normalization of HTML texts from the schedule XML (session descriptions, lecturer bios)
+# to plain text with <Text style=...> markup used by the mobile app.
+#
+# Each text is tokenized in a single pass by precompiled patterns:
+#   <br>, <br/>, <br />, <p>, </p>      line break, collapsed to space with the rest of whitespace
+#   <b>, <em> and closing ones          <Text style={styles.bold|italic}> and </Text>
+#   any other tag                       removed, together with bold / italic tags inside it
+
+import re
+import html
+
+BREAK_TAGS = ('<br>', '<br/>', '<br />', '<p>', '</p>')
+
+STYLE_TAGS = {'<b>': '<Text style={styles.bold}>',
+              '<B>': '<Text style={styles.bold}>',
+              '<em>': '<Text style={styles.italic}>',
+              '<EM>': '<Text style={styles.italic}>',
+              '</b>': '</Text>',
+              '</B>': '</Text>',
+              '</em>': '</Text>',
+              '</EM>': '</Text>',
+              }
+
+_break = '|'.join(re.escape(t) for t in BREAK_TAGS)
+_style = '|'.join(re.escape(t) for t in STYLE_TAGS)
+
+REPLACEMENTS = dict({t: '\n' for t in BREAK_TAGS}, **STYLE_TAGS)
+
+# tag spans to the first '>' on the same line, it can not contain line break tag, but can contain
+# bold / italic tags, every '<' inside is consumed either as one of these tags or as lone character
+TAG_PATTERN = re.compile(f'<(?:[^<>\\n]++|{_style}|(?!{_break}|{_style})<)*+>')
+
+# markup as html.parser recognizes it: tags, comments, declarations and processing instructions
+MARKUP_PATTERN = re.compile(r'<(?:[a-zA-Z/][^>]*|!--.*?--|![^>]*|\?[^>]*)>', re.DOTALL)
+
+
+def _replace_tag(match):
+    return REPLACEMENTS.get(match.group(), '')
+
+
+def clean_html(text):
+    if not text:
+        return None
+
+    return ' '.join(TAG_PATTERN.sub(_replace_tag, text).split())
+
+
+def html_to_text(text):
+    # text content of HTML fragment, tags removed and entities converted
+    return html.unescape(MARKUP_PATTERN.sub('', text))
+
+
+def clean_bio(bio):
+    # bios come JSON escaped, paragraphs are separated by new lines
+    if not bio:
+        return None
+
+    bio = bio.replace("\\r\\n", "\n")
+    bio = bio.encode().decode('unicode_escape')
+
+    bio = html_to_text(bio).strip('"')
+    bio = bio.replace('<\\/p>', '')
+
+    return clean_html(bio)
+
+
+# batch versions, for running in worker processes
+
+def clean_html_batch(texts):
+    return [clean_html(text) for text in texts]
+
+
+def clean_bio_batch(bios):
+    return [clean_bio(bio) for bio in bios]
@@ -5,13 +5,36 @@ import hashlib
 import json
 
 
+class StreamingChecksum:
+    """
+    md5 of data that arrives in chunks, e.g. document being downloaded,
+    chunks are hashed as they are fed and are not kept.
+    """
+
+    def __init__(self):
+        self.md5_hash = hashlib.md5()
+
+    def update(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self.md5_hash.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self.md5_hash.hexdigest()
+
+
+def calculate_md5_checksum_for_chunks(chunks):
+    checksum = StreamingChecksum()
+    for chunk in chunks:
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
 def calculate_md5_checksum(file_path):
-    md5_hash = hashlib.md5()
     with open(file_path, "rb") as f:
         # Read and update hash string value in blocks of 4K
-        for byte_block in iter(lambda: f.read(4096), b""):
-            md5_hash.update(byte_block)
-    return md5_hash.hexdigest()
+        return calculate_md5_checksum_for_chunks(iter(lambda: f.read(4096), b""))
 
 
 def calculate_md5_checksum_for_string(string):
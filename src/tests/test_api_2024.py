@@ -5,13 +5,19 @@ import os
 import pprint
 import unittest
 import uuid
+import jwt
+import asyncio
 import json
 import datetime
+import concurrent.futures
+import time
 import dotenv
 import logging
+import httpx
 from httpx import AsyncClient
 from base_test_classes import BaseAPITest
 import unittest.mock
+import pytest
 
 os.environ["TEST_MODE"] = "true"
 
@@ -21,8 +27,22 @@ logging.disable(logging.CRITICAL)
 
 from shared.redis_client import RedisClientHandler
 import fakeredis
+import fakeredis.aioredis
 from unittest.mock import patch
 
+import conferences.controller.importer as importer
+import conferences.controller.conference as conference_controller
+import conferences.controller.import_runner as import_runner
+from conferences.controller.assets import AssetRegistry
+
+
+@pytest.fixture(autouse=True)
+def import_lock_redis():
+    # import lock is taken in Redis, which is not available in tests
+    fake_redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    with patch.object(import_runner, 'get_lock_redis', return_value=fake_redis):
+        yield fake_redis
+
 
 def get_local_xml_content():
     try:
@@ -51,11 +71,126 @@ class TestAPIBasic(BaseAPITest):
             response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {token}"})
             assert response.status_code == 404
 
+    async def test_token_of_unknown_user_expect_401(self):
+        token = jwt.encode({'id_user': str(uuid.uuid4()),
+                            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)},
+                           os.getenv('JWT_SECRET_KEY', 'secret'), algorithm='HS256')
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/me", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 401
+
+            response = await ac.post("/api/authorize")
+            assert response.status_code == 200
+            token = response.json()['token']
+
+            response = await ac.get("/api/me", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200
+
     async def test_import_xml(self):
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
             response = await ac.post("/api/import-xml")  # , json={'use_local_xml': False})
             assert response.status_code == 200
 
+    async def test_import_xml_conditional_request(self):
+        xml = get_local_xml_content().encode('utf-8')
+        requests = []
+
+        def handler(request: httpx.Request):
+            requests.append(request)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, content=xml, headers={'ETag': '"v1"'})
+
+        with patch.dict(os.environ, {'XML_URL': 'http://schedule.test/sfscon2024.xml'}), \
+                patch('conferences.controller.conference.get_http_client',
+                      return_value=httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            async with AsyncClient(app=self.app, base_url="http://test") as ac:
+                response = await ac.post("/api/import-xml", json={'force': False})
+                assert response.status_code == 200
+                assert response.json()['created'] is True
+
+                response = await ac.post("/api/import-xml", json={'force': False})
+                assert response.status_code == 200
+                assert response.json()['created'] is False
+
+                # forced import does not send validators
+                response = await ac.post("/api/import-xml")
+                assert response.status_code == 200
+
+        assert [r.headers.get('If-None-Match') for r in requests] == [None, '"v1"', None]
+
+    async def test_concurrent_imports_are_coalesced(self, import_lock_redis):
+        import_conference_xml = import_runner.import_conference_xml
+        calls = []
+
+        async def counted_import(**kwargs):
+            calls.append(kwargs)
+            return await import_conference_xml(**kwargs)
+
+        with patch.object(import_runner, 'import_conference_xml', side_effect=counted_import):
+            async with AsyncClient(app=self.app, base_url="http://test") as ac:
+                # triggers with the same parameters join the same import, forced ones do not
+                # join not forced import, one forced import runs after it
+                responses = await asyncio.gather(*[ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                                                    'force': force})
+                                                   for force in (False, True, False, True)])
+
+        assert [r.status_code for r in responses] == [200, 200, 200, 200]
+        assert len({r.json()['id'] for r in responses}) == 1
+        assert [call['force'] for call in calls] == [False, True]
+        assert await import_lock_redis.get(import_runner.IMPORT_LOCK_KEY) is None
+
+    async def test_import_running_on_other_instance_is_conflict(self, import_lock_redis):
+        await import_lock_redis.set(import_runner.IMPORT_LOCK_KEY, b'other-instance', px=60000)
+
+        with patch.object(import_runner, 'import_conference_xml') as import_conference_xml:
+            async with AsyncClient(app=self.app, base_url="http://test") as ac:
+                response = await asyncio.wait_for(ac.post("/api/import-xml", json={'use_local_xml': True}), 5)
+
+        assert response.status_code == 409
+        assert response.json()['detail']['code'] == 'IMPORT_IN_PROGRESS'
+        assert not import_conference_xml.called
+        assert await import_lock_redis.get(import_runner.IMPORT_LOCK_KEY) == b'other-instance'
+
+    async def test_import_is_not_started_without_redis(self):
+        unreachable = import_runner.redis.asyncio.Redis(host='localhost', port=1, socket_connect_timeout=1)
+
+        with patch.object(import_runner, 'get_lock_redis', return_value=unreachable), \
+                patch.object(import_runner, 'import_conference_xml') as import_conference_xml:
+            async with AsyncClient(app=self.app, base_url="http://test") as ac:
+                response = await ac.post("/api/import-xml", json={'use_local_xml': True})
+
+        assert response.status_code == 503
+        assert response.json()['detail']['code'] == 'IMPORT_LOCK_NOT_AVAILABLE'
+        assert not import_conference_xml.called
+
+    async def test_import_is_cancelled_when_lock_is_lost(self, import_lock_redis):
+        cancelled = asyncio.Event()
+
+        async def slow_import(**kwargs):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def take_lock():
+            # lock expired and other instance took it
+            await asyncio.sleep(0.1)
+            await import_lock_redis.set(import_runner.IMPORT_LOCK_KEY, b'other-instance')
+
+        with patch.object(import_runner, 'IMPORT_LOCK_TTL', 0.3), \
+                patch.object(import_runner, 'import_conference_xml', side_effect=slow_import):
+            async with AsyncClient(app=self.app, base_url="http://test") as ac:
+                response, _ = await asyncio.wait_for(
+                    asyncio.gather(ac.post("/api/import-xml", json={'use_local_xml': True}), take_lock()), 5)
+
+        assert response.status_code == 409
+        assert response.json()['detail']['code'] == 'IMPORT_LOCK_LOST'
+        assert cancelled.is_set()
+        assert await import_lock_redis.get(import_runner.IMPORT_LOCK_KEY) == b'other-instance'
+
     async def test_import_xml_mockuped_result(self):
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
             response = await ac.post("/api/import-xml", json={'use_local_xml': True})
@@ -140,6 +275,187 @@ class Test2024(BaseAPITest):
 
         assert 'conference' in r and not r['conference']
 
+    async def test_get_conference_after_reimport(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            sessions = response.json()['conference']['db']['sessions']
+            id_opening = [s for s in sessions if sessions[s]['title'] == 'Opening SFSCON 2024'][0]
+            assert sessions[id_opening]['start'] == '2024-11-08 09:00:00'
+
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+            assert response.status_code == 200
+
+            response = await ac.get(f"/api/conference?last_updated={self.last_updated}",
+                                    headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            res = response.json()
+            assert res['conference'] and res['last_updated'] > self.last_updated
+            assert res['conference']['db']['sessions'][id_opening]['start'] == '2024-11-08 09:02:00'
+
+    async def test_failed_reimport_changes_nothing(self):
+        apply_changes = conference_controller.apply_changes
+
+        async def failing_apply_changes(changes, connection):
+            await apply_changes(changes, connection)
+            raise RuntimeError('import failed')
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            with patch('conferences.controller.conference.apply_changes', failing_apply_changes):
+                with pytest.raises(RuntimeError):
+                    await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                           'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml',
+                                                           'force': False})
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+            res = response.json()
+            assert res['last_updated'] == self.last_updated
+            assert res['conference']['db']['sessions'] == self.sessions
+
+            # checksum of failed import is not stored, so the same document is imported again
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml',
+                                                              'force': False})
+            assert response.status_code == 200
+            assert len(response.json()['changes']) == 3
+
+    async def test_empty_schedule_is_not_imported_without_allow_deletions(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            id_1st_session = list(self.sessions.keys())[0]
+            response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/set",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.empty.xml',
+                                                              'dry_run': True})
+            assert response.status_code == 200
+            assert len(response.json()['preview']['sessions']['deleted']) == len(self.sessions)
+            assert response.json()['preview']['requires_allow_deletions']['code'] == 'SCHEDULE_IS_EMPTY'
+
+            # force (default) does not allow deletions
+            for force in (False, True):
+                response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                                  'local_xml_fname': 'sfscon2024.empty.xml',
+                                                                  'force': force})
+                assert response.status_code == 406
+                assert response.json()['detail']['code'] == 'SCHEDULE_IS_EMPTY'
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            res = response.json()
+            assert res['last_updated'] == self.last_updated
+            assert res['conference']['db']['sessions'] == self.sessions
+            assert res['bookmarks'] == [id_1st_session]
+
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.empty.xml',
+                                                              'allow_deletions': True})
+            assert response.status_code == 200
+            assert len(response.json()['deleted_sessions']) == len(self.sessions)
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.json()['conference']['db']['sessions'] == {}
+
+    async def test_reimport_keeps_sessions_and_bookmarks(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            lecturers = response.json()['conference']['db']['lecturers']
+
+            id_1st_session = list(self.sessions.keys())[0]
+            response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/set",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+            assert response.status_code == 200
+            assert len(response.json()['changes']) == 3
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            res = response.json()
+            assert set(res['conference']['db']['sessions'].keys()) == set(self.sessions.keys())
+            assert res['conference']['db']['lecturers'] == lecturers
+            assert res['bookmarks'] == [id_1st_session]
+
+            # importing the same document again changes nothing
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+            assert response.status_code == 200
+            assert response.json()['changes'] == {}
+
+    async def test_reimport_parses_only_changed_events(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            with patch('conferences.controller.importer.parse_event', wraps=importer.parse_event) as parse_event:
+                response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                                  'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+                assert response.status_code == 200
+                assert len(response.json()['changes']) == 3
+                assert parse_event.call_count == 3
+
+                parse_event.reset_mock()
+
+                response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                                  'local_xml_fname': 'sfscon2024.xml'})
+                assert response.status_code == 200
+                assert len(response.json()['changes']) == 3
+                assert parse_event.call_count == 3
+
+    async def test_updated_lecturer_values_are_escaped(self):
+        lecturer = await conference_controller.models.ConferenceLecturer.filter().first()
+        lecturer.display_name = "Shaun O'Neil"
+        lecturer.social_networks = [{'name': 'x', 'url': "https://e.com/o'neil"}]
+
+        async with conference_controller.in_transaction() as connection:
+            await importer.update_fields(conference_controller.models.ConferenceLecturer, [lecturer],
+                                         ['display_name', 'social_networks'], connection)
+
+        lecturer = await conference_controller.models.ConferenceLecturer.get(id=lecturer.id)
+        assert lecturer.display_name == "Shaun O'Neil"
+        assert lecturer.social_networks == [{'name': 'x', 'url': "https://e.com/o'neil"}]
+
+    async def test_import_recovers_from_broken_text_pool(self):
+        pool = importer.get_text_pool()
+
+        # worker killed, e.g. for memory
+        with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+            await asyncio.wrap_future(pool.submit(os._exit, 1))
+
+        with patch.object(importer, 'IMPORT_TEXT_WORKERS', 2), \
+                patch.object(importer, 'shutdown_text_pool', wraps=importer.shutdown_text_pool) as shutdown:
+            async with AsyncClient(app=self.app, base_url="http://test") as ac:
+                response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                                  'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+                assert response.status_code == 200
+                assert len(response.json()['changes']) == 3
+
+            shutdown.assert_called_once_with(wait=False)
+            assert importer.get_text_pool() is not pool
+
+    async def test_reimport_cleans_only_changed_bios(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            lecturers = response.json()['conference']['db']['lecturers']
+
+            with patch('conferences.controller.importer.run_text_batches',
+                       wraps=importer.run_text_batches) as run_text_batches:
+                response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                                  'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+                assert response.status_code == 200
+
+                # persons are the same as in the first import, so no bio is sent to the pool
+                bios = [texts for fn, texts in (call.args for call in run_text_batches.call_args_list)
+                        if fn is importer.clean_bio_batch]
+                assert bios == [[]]
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.json()['conference']['db']['lecturers'] == lecturers
+
     async def test_bookmarks(self):
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
             response = await ac.get(f"/api/conference?last_updated={self.last_updated}",
@@ -180,6 +496,230 @@ class Test2024(BaseAPITest):
             assert 'bookmarks' in res
             assert res['bookmarks'] == []
 
+    async def test_set_and_unset_bookmark(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            id_1st_session = list(self.sessions.keys())[0]
+
+            # set and unset are idempotent, so double taps / retries keep the same state
+            for _ in range(2):
+                response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/set",
+                                         headers={"Authorization": f"Bearer {self.token}"})
+                assert response.status_code == 200
+                assert response.json() == {'bookmarked': True}
+
+            response = await ac.get("/api/me/state", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.json()['bookmarks'] == [id_1st_session]
+
+            for _ in range(2):
+                response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/unset",
+                                         headers={"Authorization": f"Bearer {self.token}"})
+                assert response.status_code == 200
+                assert response.json() == {'bookmarked': False}
+
+            response = await ac.get("/api/me/state", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.json()['bookmarks'] == []
+
+            response = await ac.post(f"/api/sessions/{uuid.uuid4()}/bookmarks/set",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 404
+            assert response.json()['detail']['code'] == 'SESSION_NOT_FOUND'
+
+            response = await ac.post(f"/api/sessions/{uuid.uuid4()}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 404
+
+            # user removed after it was authorized, insert fails on user, not on session foreign key
+
+            id_user = jwt.decode(self.token, options={'verify_signature': False})['id_user']
+            await conference_controller.models.UserAnonymous.filter(id=id_user).delete()
+
+            response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/set",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 404
+            assert response.json()['detail']['code'] == 'USER_NOT_FOUND'
+
+    async def test_get_conference_with_etag(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+            etag = response.headers['etag']
+            assert etag
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}",
+                                                                "If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.headers['etag'] == etag
+
+            # other user has its own bookmarks and rates, so etag is different
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token2}",
+                                                                "If-None-Match": etag})
+            assert response.status_code == 200
+
+            # any change of user state invalidates etag
+
+            id_1st_session = list(self.sessions.keys())[0]
+            response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}",
+                                                                "If-None-Match": etag})
+            assert response.status_code == 200
+            assert response.headers['etag'] != etag
+            assert response.json()['bookmarks'] == [id_1st_session]
+
+    async def test_conference_etag_sees_writes_of_other_processes(self):
+        id_1st_session = list(self.sessions.keys())[0]
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+            etag = response.headers['etag']
+
+            # etag is checked against versions stored in database, without reading user state
+            with patch.object(conference_controller, 'opencon_serialize_anonymouse') as serialize:
+                response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}",
+                                                                    "If-None-Match": etag})
+                assert response.status_code == 304
+                assert not serialize.called
+
+            # rate written by other instance, directly into database
+            await conference_controller.models.SessionRates.create(session_id=id_1st_session,
+                                                                   nr_votes=1, total_rates=4, nr_rates_4=1)
+            await conference_controller.models.UserAnonymous._meta.db.execute_query(
+                conference_controller.BUMP_RATINGS_VERSION_SQL)
+
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}",
+                                                                "If-None-Match": etag})
+            assert response.status_code == 200
+            assert response.headers['etag'] != etag
+            assert response.json()['ratings']['rates_by_session'] == {id_1st_session: [4.0, 1]}
+
+            etag = response.headers['etag']
+            response = await ac.get("/api/conference", headers={"Authorization": f"Bearer {self.token}",
+                                                                "If-None-Match": etag})
+            assert response.status_code == 304
+
+    async def test_get_conference_schedule_precompressed(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/conference/schedule", headers={"Authorization": f"Bearer {self.token}",
+                                                                         "Accept-Encoding": "gzip"})
+            assert response.status_code == 200
+            assert response.headers['content-encoding'] == 'gzip'
+            assert response.json()['last_updated'] == self.last_updated
+            assert response.json()['conference']['db']['sessions'] == self.sessions
+
+            etag = response.headers['etag']
+            response = await ac.get("/api/conference/schedule", headers={"Authorization": f"Bearer {self.token2}",
+                                                                         "Accept-Encoding": "gzip",
+                                                                         "If-None-Match": etag})
+            assert response.status_code == 304
+
+            # snapshot built again from the same content (as after restart or on other instance) has the same etag
+            sponsors = conference_controller.side_assets.assets['sponsors']
+            os.utime(sponsors.path)
+            conference_controller.side_assets.refresh(force=True)
+            assert sponsors.version > 1
+            conference_controller.invalidate_conference_snapshot()
+            response = await ac.get("/api/conference/schedule", headers={"Authorization": f"Bearer {self.token2}",
+                                                                         "Accept-Encoding": "gzip",
+                                                                         "If-None-Match": etag})
+            assert response.status_code == 304
+
+            response = await ac.get("/api/conference/schedule", headers={"Authorization": f"Bearer {self.token}",
+                                                                         "Accept-Encoding": "identity"})
+            assert response.status_code == 200
+            assert 'content-encoding' not in response.headers
+            assert response.headers['etag'] != etag
+            assert response.json()['conference']['acronym'] == 'sfscon-2024'
+
+    async def test_my_state(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.get("/api/me/state", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            res = response.json()
+            assert res['bookmarks'] == []
+            assert res['my_rate_by_session'] == {}
+            assert res['ratings_digest']
+
+            id_1st_session = list(self.sessions.keys())[0]
+            response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            response = await ac.get("/api/me/state", headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+            assert response.json()['bookmarks'] == [id_1st_session]
+
+            response = await ac.get("/api/me/state", headers={"Authorization": f"Bearer {self.token2}"})
+            assert response.status_code == 200
+            assert response.json()['bookmarks'] == []
+            assert response.json()['ratings_digest'] == res['ratings_digest']
+
+    async def test_sync_my_state(self):
+        id_cra_session = None
+        for s in self.sessions:
+            if self.sessions[s]['title'] == 'Let’s all get over the CRA!':
+                id_cra_session = s
+                break
+
+        assert id_cra_session
+
+        id_sessions = [s for s in self.sessions.keys() if s != id_cra_session][:3]
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post(f"/api/sessions/{id_sessions[0]}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            with unittest.mock.patch('conferences.controller.conference.now') as mocked_datetime:
+                mocked_datetime.now = datetime.datetime(2024, 11, 8, 11, 0)
+                response = await ac.post("/api/me/sync",
+                                         json={'bookmarks': {id_sessions[0]: False,
+                                                             id_sessions[1]: True,
+                                                             id_sessions[2]: True,
+                                                             id_cra_session: True},
+                                               'ratings': {id_cra_session: 4}},
+                                         headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+
+            res = response.json()
+            assert sorted(res['bookmarks']) == sorted([id_sessions[1], id_sessions[2], id_cra_session])
+            assert res['my_rate_by_session'] == {id_cra_session: 4}
+
+            # next sync carries only what was changed since the previous one
+
+            with unittest.mock.patch('conferences.controller.conference.now') as mocked_datetime:
+                mocked_datetime.now = datetime.datetime(2024, 11, 8, 11, 0)
+                response = await ac.post("/api/me/sync",
+                                         json={'bookmarks': {id_sessions[2]: False},
+                                               'ratings': {id_cra_session: 2}},
+                                         headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 200
+            assert sorted(response.json()['bookmarks']) == sorted([id_sessions[1], id_cra_session])
+            assert response.json()['my_rate_by_session'] == {id_cra_session: 2}
+
+            response = await ac.get(f"/api/conference?last_updated={self.last_updated}",
+                                    headers={"Authorization": f"Bearer {self.token2}"})
+            assert response.json()['ratings']['rates_by_session'] == {id_cra_session: [2.0, 1]}
+
+            # sessions which can not be rated are rejected and nothing is stored
+
+            response = await ac.post("/api/me/sync",
+                                     json={'bookmarks': {id_sessions[0]: True},
+                                           'ratings': {id_sessions[0]: 4}},
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 406
+
+            response = await ac.post("/api/me/sync", json={'bookmarks': {str(uuid.uuid4()): True}},
+                                     headers={"Authorization": f"Bearer {self.token}"})
+            assert response.status_code == 404
+
+            response = await ac.get("/api/me/state", headers={"Authorization": f"Bearer {self.token}"})
+            assert sorted(response.json()['bookmarks']) == sorted([id_sessions[1], id_cra_session])
+
     async def test_rating(self):
         # ...
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
@@ -404,11 +944,27 @@ class Test2024(BaseAPITest):
             assert response.status_code == 200
             assert response.json() == {'bookmarked': True}
 
+            # dry run reports what import would do, without changing anything
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml',
+                                                              'group_notifications_by_user': group_notifications_by_user,
+                                                              'dry_run': True
+                                                              })
+            assert response.status_code == 200
+            res = response.json()
+            assert res['dry_run'] is True
+            assert len(res['changes']) == 3
+            assert len(res['preview']['sessions']['rescheduled']) == 3
+            assert res['preview']['sessions']['new'] == [] and res['preview']['sessions']['deleted'] == []
+            assert res['preview']['push_notifications'] == expected_notifications
+            assert RedisClientHandler.get_redis_client().get_all_messages('opencon_push_notification') == []
+
             response = await ac.post("/api/import-xml", json={'use_local_xml': True,
                                                               'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml',
                                                               'group_notifications_by_user': group_notifications_by_user
                                                               })
             assert response.status_code == 200
+            assert len(response.json()['changes']) == 3
 
         redis_client = RedisClientHandler.get_redis_client()
         all_messages = redis_client.get_all_messages('opencon_push_notification')
@@ -575,3 +1131,65 @@ class TestAdmin(BaseAPITest):
             assert 'data' in response.json()
             assert len(response.json()['data']) > 10
 
+    async def test_get_sessions_by_bookmarks(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post("/api/admin/login", json={"username": "admin", "password": "admin"})
+            assert response.status_code == 200
+            admin_token = response.json()['token']
+
+            id_1st_session = None
+            for s in self.sessions:
+                if self.sessions[s]['title'] == 'Let’s all get over the CRA!':
+                    id_1st_session = s
+                    break
+
+            assert id_1st_session
+
+            for token in (self.token1, self.token2):
+                response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/toggle",
+                                         headers={"Authorization": f"Bearer {token}"})
+                assert response.status_code == 200
+
+            response = await ac.get('/api/admin/sessions_by_bookmarks',
+                                    headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+
+            res = response.json()['data']
+            assert len(res) == len(self.sessions)
+            assert res[0] == {'title': 'Let’s all get over the CRA!', 'bookmarks': 2}
+            assert res[1]['bookmarks'] == 0
+
+
+    async def test_get_assets_stats(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post("/api/admin/login", json={"username": "admin", "password": "admin"})
+            assert response.status_code == 200
+            admin_token = response.json()['token']
+
+            response = await ac.get('/api/admin/assets', headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+
+            res = response.json()['data']
+            assert set(res.keys()) == {'streaming_links', 'sponsors'}
+            assert res['sponsors']['version'] >= 1
+            assert res['sponsors']['last_reload_ms'] is not None
+
+    async def test_missing_or_invalid_asset_keeps_last_good_version(self):
+        fname = f'/tmp/test_asset_{uuid.uuid4()}.yaml'
+        registry = AssetRegistry(check_interval=0)
+
+        # missing file does not break registration nor reading
+        registry.register('asset', fname)
+        assert registry.get('asset') is None
+
+        with open(fname, 'w') as f:
+            f.write('key: value\n')
+        assert registry.get('asset') == {'key': 'value'}
+
+        with open(fname, 'w') as f:
+            f.write('key: [value\n')
+        os.utime(fname, ns=(0, time.time_ns() + 1_000_000))
+        assert registry.get('asset') == {'key': 'value'}
+
+        os.unlink(fname)
+        assert registry.get('asset') == {'key': 'value'}
@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+# Polls the schedule source (XML_URL) and imports it when changed.
+#
+# Requests are conditional (ETag / Last-Modified), so unchanged schedule costs one 304 response.
+# Polling interval is randomized by IMPORT_POLL_JITTER, so instances started together do not poll
+# at the same moment, and the import itself is guarded by the Redis lock (see
+# conferences/controller/import_runner.py), so only one import runs cluster-wide.
+
+import os
+import sys
+import dotenv
+import random
+import logging
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+dotenv.load_dotenv()
+
+from tortoise import Tortoise
+from fastapi import HTTPException, status
+
+from db_config import DB_CONFIG
+import conferences.controller as controller
+from conferences.controller.importer import shutdown_text_pool
+
+IMPORT_POLL_INTERVAL = float(os.getenv('IMPORT_POLL_INTERVAL', 60))
+IMPORT_POLL_JITTER = float(os.getenv('IMPORT_POLL_JITTER', 0.2))
+
+
+def next_poll_in(interval=IMPORT_POLL_INTERVAL, jitter=IMPORT_POLL_JITTER):
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+async def poll_schedule():
+    log = logging.getLogger('schedule_importer')
+
+    await Tortoise.init(config=DB_CONFIG)
+    log.info(f"Worker started, polling {os.getenv('XML_URL')} every ~{IMPORT_POLL_INTERVAL}s")
+
+    # instances started at the same time spread their first poll over the jitter window
+    await asyncio.sleep(random.uniform(0, IMPORT_POLL_INTERVAL * IMPORT_POLL_JITTER))
+
+    try:
+        while True:
+            try:
+                res = await controller.run_import(force=False)
+
+                if res.get('not_modified') or res.get('checksum_matches'):
+                    log.info('Schedule not changed')
+                else:
+                    log.info(f"Schedule imported, {len(res['changes'])} sessions rescheduled")
+
+            except HTTPException as e:
+                if e.status_code == status.HTTP_409_CONFLICT:
+                    log.info(f"Schedule not imported :: {e.detail['message']}")
+                elif e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+                    # without the lock import is not guarded cluster-wide, it is retried on the next poll
+                    log.warning(f"Schedule import skipped :: {e.detail['message']}")
+                else:
+                    log.critical(f'Error importing schedule :: {str(e)}')
+            except Exception as e:
+                log.critical(f'Error importing schedule :: {str(e)}')
+
+            await asyncio.sleep(next_poll_in())
+    finally:
+        shutdown_text_pool()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s | %(message)s')
+    asyncio.run(poll_schedule())